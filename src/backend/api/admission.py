@@ -0,0 +1,213 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from api.cancellation import check_cancelled
+
+# Smoothing factor for the moving average of request service time
+SERVICE_TIME_SMOOTHING = 0.2
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is turned away because the server is at capacity
+    """
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server is busy ({reason}), retry in {retry_after} s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+@contextmanager
+def wake_on_cancel(cond, cancel_token):
+    """
+    Notify everyone waiting on cond while the enclosed block runs if the
+    token is cancelled, so a cancelled request stops waiting for a slot
+    """
+    if cancel_token is None:
+        yield
+        return
+
+    def wake():
+        with cond:
+            cond.notify_all()
+
+    cancel_token.add_callback(wake)
+    try:
+        yield
+    finally:
+        cancel_token.remove_callback(wake)
+
+class StageLimiter:
+    """
+    Concurrency cap for one stage of the analysis pipeline
+
+    Requests that were already admitted wait for a free slot instead of
+    being rejected, so a stage cap only shapes how admitted work overlaps.
+    """
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, cancel_token=None):
+        """
+        Hold a slot of this stage, raising AnalysisCancelled if the token
+        is cancelled or expires while waiting for one
+        """
+        with wake_on_cancel(self._cond, cancel_token), self._cond:
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    check_cancelled(cancel_token)
+                    self._cond.wait(cancel_token.remaining() if cancel_token is not None else None)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                # Wake every waiter, since some may only be leaving after a cancellation
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'waiting': self.waiting
+            }
+
+class AdmissionController:
+    """
+    Concurrency limiter with a bounded wait queue for the analysis pipeline
+
+    At most max_concurrent requests run at once and at most max_queue wait
+    for a slot. Requests beyond that, or that wait longer than queue_timeout
+    seconds, are rejected immediately with an estimated retry delay so that
+    latency for admitted requests stays bounded at saturation.
+
+    Parameters:
+    -----------
+    max_concurrent : int
+        Number of requests allowed to run the pipeline at the same time
+    max_queue : int
+        Number of requests allowed to wait for a free slot
+    queue_timeout : float
+        Maximum time in seconds a request waits in the queue
+    stage_limits : dict
+        Mapping of pipeline stage name to its concurrency cap
+    """
+    def __init__(self, max_concurrent=4, max_queue=8, queue_timeout=10.0, stage_limits=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.stages = {name: StageLimiter(name, limit)
+                       for name, limit in (stage_limits or {}).items()}
+
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0}
+        self.service_time = None
+
+    @contextmanager
+    def admit(self, timeout=None, cancel_token=None):
+        """
+        Run the enclosed block once a pipeline slot is available
+
+        Raises AdmissionRejected if the wait queue is full or no slot frees
+        up within the queue timeout (or the given timeout, if shorter).
+        A queued request whose cancel_token is cancelled or reaches its
+        deadline stops waiting with AnalysisCancelled instead.
+        """
+        if timeout is None:
+            timeout = self.queue_timeout
+        else:
+            timeout = min(timeout, self.queue_timeout)
+        if cancel_token is not None and cancel_token.deadline is not None:
+            timeout = min(timeout, cancel_token.remaining())
+
+        self._acquire(timeout, cancel_token)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def stage(self, name, cancel_token=None):
+        """
+        Context manager holding a slot of the named pipeline stage
+        """
+        return self.stages[name].slot(cancel_token)
+
+    def _acquire(self, timeout, cancel_token=None):
+        with wake_on_cancel(self._cond, cancel_token), self._cond:
+            check_cancelled(cancel_token)
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self._reject('queue_full')
+
+                deadline = time.monotonic() + timeout
+                self.waiting += 1
+                try:
+                    while self.active >= self.max_concurrent:
+                        # The token is checked first so that a request whose
+                        # own deadline passed is cancelled, not rejected
+                        check_cancelled(cancel_token)
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject('queue_timeout')
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+
+    def _release(self, elapsed):
+        with self._cond:
+            self.active -= 1
+            self.completed += 1
+            if self.service_time is None:
+                self.service_time = elapsed
+            else:
+                self.service_time += SERVICE_TIME_SMOOTHING * (elapsed - self.service_time)
+            self._cond.notify_all()
+
+    def _reject(self, reason):
+        # Called with the lock held
+        self.rejected[reason] += 1
+        raise AdmissionRejected(reason, self._retry_after())
+
+    def _retry_after(self):
+        """
+        Estimate how many seconds until the current backlog has drained
+        """
+        if self.service_time is None:
+            return 1
+        backlog = (self.waiting + self.active) / self.max_concurrent
+        return max(1, int(math.ceil(backlog * self.service_time)))
+
+    def stats(self):
+        """
+        Get queue depth, admission counters and per-stage occupancy
+        """
+        with self._cond:
+            stats = {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'admitted': self.admitted,
+                'completed': self.completed,
+                'rejected': dict(self.rejected),
+                'mean_service_time': self.service_time
+            }
+        stats['stages'] = {name: stage.stats() for name, stage in self.stages.items()}
+        return stats
@@ -1,6 +1,8 @@
 import numpy as np
 import json
 import os
+from api.precision import ACTIVATION_DTYPE
+from api.cancellation import check_cancelled
 
 # Define brain regions associated with different emotions
 # This is a simplified mapping based on neuroscience research
@@ -73,7 +75,12 @@ BRAIN_REGION_COORDINATES = {
     'anterior_insula': {'x': [35, -35], 'y': [15], 'z': [5]}
 }
 
-def map_emotion_to_brain(emotion_data):
+# Grid sizes of the activation volume pyramid, coarsest first
+# Levels below DEFAULT_GRID_SIZE divide it exactly so they max-pool from it
+PYRAMID_LEVELS = [25, 50, 100, 200]
+DEFAULT_GRID_SIZE = 100
+
+def map_emotion_to_brain(emotion_data, include_voxels=True, cancel_token=None):
     """
     Map emotion scores to brain activation patterns
     
@@ -81,6 +88,11 @@ def map_emotion_to_brain(emotion_data):
     -----------
     emotion_data : dict
         Dictionary containing emotion scores
+    include_voxels : bool
+        Whether to generate the voxel grid; callers that only need region
+        activations (e.g. on an overlay cache hit) can skip it
+    cancel_token : CancellationToken, optional
+        Token checked between units of work to stop abandoned requests
         
     Returns:
     --------
@@ -118,7 +130,9 @@ def map_emotion_to_brain(emotion_data):
             activation_map['regions'][region] /= max_activation
     
     # Generate voxel-based activation data for visualization
-    activation_map['voxel_data'] = generate_voxel_activations(activation_map['regions'])
+    if include_voxels:
+        activation_map['voxel_data'] = generate_voxel_activations(activation_map['regions'],
+                                                                  cancel_token=cancel_token)
     
     # Generate time series data from segments
     if 'segments' in emotion_data:
@@ -126,65 +140,213 @@ def map_emotion_to_brain(emotion_data):
     
     return activation_map
 
-def generate_voxel_activations(region_activations, grid_size=100):
+def generate_voxel_activations(region_activations, grid_size=DEFAULT_GRID_SIZE, cancel_token=None,
+                               radii=None):
     """
     Generate voxel-based activation data for visualization
     
     This creates a simplified 3D grid of activation values
     In a real application, this would map to actual MRI voxel coordinates
     """
+    grid = build_activation_grid(region_activations, grid_size, cancel_token, radii=radii)
+    return sparse_voxels(grid)
+
+def sphere_radius(activation, grid_size=DEFAULT_GRID_SIZE):
+    """
+    Radius in voxels of a region's activation sphere, 0 if it is not drawn
+    
+    The radius is scaled with the grid so a region covers the same
+    anatomical extent at every resolution.
+    """
+    if activation <= 0.1:  # Only include regions with significant activation
+        return 0
+    return int(5 * activation * (grid_size / 100))
+
+def sphere_radii(region_activations, grid_size=DEFAULT_GRID_SIZE):
+    """
+    Get the activation sphere radius of every region
+    """
+    return {region_name: sphere_radius(activation, grid_size)
+            for region_name, activation in region_activations.items()}
+
+def build_activation_grid(region_activations, grid_size=DEFAULT_GRID_SIZE, cancel_token=None,
+                          dtype=ACTIVATION_DTYPE, radii=None):
+    """
+    Build a dense 3D grid of activation values
+    
+    Each active region adds a sphere of activation around its coordinates.
+    Sphere radii follow the activations unless given explicitly (radii from
+    sphere_radii), which lets rounded activations be drawn with the shapes of
+    the exact ones. The grid is float32 unless another dtype is requested
+    (e.g. float64 to check the precision policy).
+    """
     # Create empty 3D grid
-    grid = np.zeros((grid_size, grid_size, grid_size))
+    grid = np.zeros((grid_size, grid_size, grid_size), dtype=dtype)
+    
+    for center, radius, activation in activation_spheres(region_activations, grid_size,
+                                                         cancel_token, radii):
+        add_activation_sphere(grid, center, radius, activation)
+    
+    return grid
+
+def activation_spheres(region_activations, grid_size=DEFAULT_GRID_SIZE, cancel_token=None,
+                       radii=None):
+    """
+    Yield the (center, radius, activation) of every sphere drawn on a grid
+    """
+    if radii is None:
+        radii = sphere_radii(region_activations, grid_size)
     
     # For each active region, add activation to corresponding voxels
     for region_name, activation in region_activations.items():
-        if activation > 0.1:  # Only include regions with significant activation
-            coords = BRAIN_REGION_COORDINATES[region_name]
-            
-            # For each coordinate in the region
-            for x in coords['x']:
-                for y in coords['y']:
-                    for z in coords['z']:
-                        # Convert from anatomical coordinates to grid indices
-                        grid_x = int((x + 50) * grid_size / 100)
-                        grid_y = int((y + 50) * grid_size / 100)
-                        grid_z = int((z + 50) * grid_size / 100)
-                        
-                        # Ensure coordinates are within grid bounds
-                        if 0 <= grid_x < grid_size and 0 <= grid_y < grid_size and 0 <= grid_z < grid_size:
-                            # Create a small sphere of activation around the coordinate
-                            radius = int(5 * activation)
-                            for dx in range(-radius, radius+1):
-                                for dy in range(-radius, radius+1):
-                                    for dz in range(-radius, radius+1):
-                                        # Calculate distance from center
-                                        distance = np.sqrt(dx**2 + dy**2 + dz**2)
-                                        if distance <= radius:
-                                            # Calculate activation based on distance from center
-                                            voxel_activation = activation * (1 - distance/radius)
-                                            
-                                            # Set voxel activation (with bounds checking)
-                                            vx, vy, vz = grid_x+dx, grid_y+dy, grid_z+dz
-                                            if 0 <= vx < grid_size and 0 <= vy < grid_size and 0 <= vz < grid_size:
-                                                # Use maximum if multiple regions overlap
-                                                grid[vx, vy, vz] = max(grid[vx, vy, vz], voxel_activation)
-    
-    # Convert to list format for JSON serialization
-    # We'll use a sparse representation to reduce data size
-    voxel_list = []
-    for x in range(grid_size):
-        for y in range(grid_size):
-            for z in range(grid_size):
-                if grid[x, y, z] > 0.1:  # Only include voxels with significant activation
-                    voxel_list.append({
-                        'x': x,
-                        'y': y,
-                        'z': z,
-                        'value': float(grid[x, y, z])
-                    })
+        check_cancelled(cancel_token)
+        radius = radii[region_name]
+        if radius == 0:
+            continue
+        coords = BRAIN_REGION_COORDINATES[region_name]
+        
+        # For each coordinate in the region
+        for x in coords['x']:
+            for y in coords['y']:
+                for z in coords['z']:
+                    # Convert from anatomical coordinates to grid indices
+                    grid_x = int((x + 50) * grid_size / 100)
+                    grid_y = int((y + 50) * grid_size / 100)
+                    grid_z = int((z + 50) * grid_size / 100)
+                    
+                    # Ensure coordinates are within grid bounds
+                    if 0 <= grid_x < grid_size and 0 <= grid_y < grid_size and 0 <= grid_z < grid_size:
+                        yield (grid_x, grid_y, grid_z), radius, activation
+
+def sphere_values(dx, dy, dz, radius, activation, dtype=ACTIVATION_DTYPE):
+    """
+    Activation of a sphere that falls off linearly from its center, at the
+    given (broadcastable) voxel offsets from the center
+    """
+    distance = np.sqrt(dx**2 + dy**2 + dz**2)
+    return np.where(distance <= radius, activation * (1 - distance / radius), 0).astype(dtype)
+
+def add_activation_sphere(grid, center, radius, activation):
+    """
+    Add a sphere of activation that falls off linearly from its center
+    
+    Voxels outside the grid are clipped, and the maximum is kept where the
+    sphere overlaps existing activation.
+    """
+    lo = [max(c - radius, 0) for c in center]
+    hi = [min(c + radius + 1, size) for c, size in zip(center, grid.shape)]
+    dx, dy, dz = np.ogrid[lo[0] - center[0]:hi[0] - center[0],
+                          lo[1] - center[1]:hi[1] - center[1],
+                          lo[2] - center[2]:hi[2] - center[2]]
+    sphere = sphere_values(dx, dy, dz, radius, activation, grid.dtype)
+    
+    # Use maximum if multiple regions overlap
+    block = grid[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    np.maximum(block, sphere, out=block)
+
+def build_pooled_grid(region_activations, factor, cancel_token=None, dtype=ACTIVATION_DTYPE):
+    """
+    Build the DEFAULT_GRID_SIZE grid max-pooled by factor, without the fine grid
+    
+    A sphere's activation only falls with distance, so its peak within a
+    coarse voxel is at the fine voxel nearest the center. The spheres of
+    DEFAULT_GRID_SIZE are stamped straight onto the coarse grid with those
+    distances, which gives exactly
+    max_pool(build_activation_grid(region_activations), factor) at the cost
+    of drawing the coarse grid.
+    """
+    size = DEFAULT_GRID_SIZE // factor
+    grid = np.zeros((size, size, size), dtype=dtype)
+    
+    for center, radius, activation in activation_spheres(region_activations, DEFAULT_GRID_SIZE,
+                                                         cancel_token):
+        starts, offsets = [], []
+        for c in center:
+            blocks = range(max(c - radius, 0) // factor,
+                           min(c + radius, size * factor - 1) // factor + 1)
+            starts.append(blocks[0])
+            # Offset of the fine voxel in each coarse voxel nearest the center
+            offsets.append([min(max(c, b * factor), b * factor + factor - 1) - c for b in blocks])
+        
+        dx, dy, dz = np.ix_(*offsets)
+        sphere = sphere_values(dx, dy, dz, radius, activation, dtype)
+        block = grid[starts[0]:starts[0] + sphere.shape[0], starts[1]:starts[1] + sphere.shape[1],
+                     starts[2]:starts[2] + sphere.shape[2]]
+        np.maximum(block, sphere, out=block)
+    
+    return grid
+
+def build_activation_level(region_activations, grid_size=DEFAULT_GRID_SIZE, cancel_token=None):
+    """
+    Build the activation grid of one pyramid level
+    
+    Spheres only a voxel or two across cannot be drawn faithfully on coarse
+    grids (their radii truncate to zero), so levels below DEFAULT_GRID_SIZE
+    are max-pooled from the spheres drawn at DEFAULT_GRID_SIZE, and a coarse
+    voxel holds the peak activation within its extent. Finer levels are
+    computed directly.
+    """
+    if grid_size not in PYRAMID_LEVELS:
+        raise ValueError(f"Level of detail must be one of {PYRAMID_LEVELS}")
+    
+    if grid_size >= DEFAULT_GRID_SIZE:
+        return build_activation_grid(region_activations, grid_size, cancel_token)
+    return build_pooled_grid(region_activations, DEFAULT_GRID_SIZE // grid_size, cancel_token)
+
+def build_activation_pyramid(region_activations, grid_size=DEFAULT_GRID_SIZE, cancel_token=None):
+    """
+    Build activation grids for every pyramid level up to grid_size
+    
+    Levels are generated coarsest first and each one is only computed when
+    it is requested, so a client can be sent the coarsest level before the
+    finer ones exist. Every level is exactly what build_activation_level
+    returns for it.
+    
+    Parameters:
+    -----------
+    region_activations : dict
+        Normalized region activations
+    grid_size : int
+        Finest level to build, one of PYRAMID_LEVELS
+        
+    Yields:
+    -------
+    tuple
+        (grid_size, grid) pairs, coarsest first
+    """
+    if grid_size not in PYRAMID_LEVELS:
+        raise ValueError(f"Level of detail must be one of {PYRAMID_LEVELS}")
+    return _generate_pyramid(region_activations, grid_size, cancel_token)
+
+def _generate_pyramid(region_activations, grid_size, cancel_token):
+    for level in PYRAMID_LEVELS:
+        if level > grid_size:
+            break
+        yield level, build_activation_level(region_activations, level, cancel_token)
+
+def max_pool(grid, factor):
+    """
+    Downsample a 3D grid by taking the maximum over factor^3 blocks
+    """
+    nx, ny, nz = (n // factor for n in grid.shape)
+    trimmed = grid[:nx * factor, :ny * factor, :nz * factor]
+    return trimmed.reshape(nx, factor, ny, factor, nz, factor).max(axis=(1, 3, 5))
+
+def sparse_voxels(grid, threshold=0.1):
+    """
+    Convert a dense activation grid to the sparse voxel list sent to clients
+    """
+    # Only include voxels with significant activation
+    xs, ys, zs = np.nonzero(grid > threshold)
+    voxel_list = [{
+        'x': int(x),
+        'y': int(y),
+        'z': int(z),
+        'value': float(value)
+    } for x, y, z, value in zip(xs, ys, zs, grid[xs, ys, zs])]
     
     return {
-        'dimensions': [grid_size, grid_size, grid_size],
+        'dimensions': list(grid.shape),
         'voxels': voxel_list
     }
 
@@ -0,0 +1,137 @@
+import threading
+import time
+
+class AnalysisCancelled(Exception):
+    """
+    Raised inside the pipeline when a request was cancelled or ran past its deadline
+    """
+    def __init__(self, reason):
+        super().__init__(f"Analysis stopped ({reason})")
+        self.reason = reason
+
+class CancellationToken:
+    """
+    Cancellation flag with an optional deadline, shared with the pipeline
+
+    Pipeline functions call check_cancelled(token) between units of work
+    (segments, slice renders), so a cancelled or expired request stops
+    within one unit.
+
+    Parameters:
+    -----------
+    timeout : float, optional
+        Seconds from now until the deadline, or None for no deadline
+    """
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self, reason='client'):
+        """
+        Request that the pipeline stops at its next check
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        """
+        Call callback once when the token is cancelled, e.g. to wake a waiter
+
+        Expiry of the deadline only cancels the token when it is next checked,
+        so waiters should also bound their wait by remaining().
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        """
+        Remove a callback added with add_callback that is no longer needed
+        """
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel('deadline')
+        return self._event.is_set()
+
+    def remaining(self):
+        """
+        Seconds left until the deadline, or None if there is no deadline
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """
+        Raise AnalysisCancelled if the token was cancelled or has expired
+        """
+        if self.cancelled:
+            raise AnalysisCancelled(self.reason)
+
+def check_cancelled(token):
+    """
+    Check an optional cancellation token
+    """
+    if token is not None:
+        token.check()
+
+class CancellationRegistry:
+    """
+    Tracks the tokens of in-flight requests so clients can cancel them by id
+    and counts how many requests stopped early, by reason
+    """
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self.cancelled = {'client': 0, 'deadline': 0}
+
+    def register(self, request_id, token):
+        with self._lock:
+            if request_id in self._tokens:
+                raise ValueError(f"Request id already in use: {request_id}")
+            self._tokens[request_id] = token
+
+    def unregister(self, request_id):
+        with self._lock:
+            self._tokens.pop(request_id, None)
+
+    def cancel(self, request_id):
+        """
+        Cancel an in-flight request, returning False if it is not running
+        """
+        with self._lock:
+            token = self._tokens.get(request_id)
+        if token is None:
+            return False
+        token.cancel('client')
+        return True
+
+    def record(self, reason):
+        """
+        Count a request that stopped because of a cancellation
+        """
+        with self._lock:
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._tokens),
+                'cancelled': dict(self.cancelled)
+            }
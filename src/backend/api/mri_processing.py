@@ -7,11 +7,17 @@ import matplotlib.pyplot as plt
 from io import BytesIO
 import base64
 import requests
+from functools import lru_cache
 from api.brain_mapping import get_emotion_colors
+from api.precision import MRI_DTYPE, DISPLAY_DTYPE, quantize_unit
+from api.cancellation import check_cancelled
 
 # Path to store downloaded MRI data
 MRI_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'mri')
 
+# Overlay alpha levels below this are not drawn
+OVERLAY_ALPHA_THRESHOLD = 50
+
 # Ensure MRI data directory exists
 os.makedirs(MRI_DATA_DIR, exist_ok=True)
 
@@ -28,7 +34,23 @@ def download_sample_mri_data():
     mni_template = datasets.fetch_icbm152_2009(data_dir=MRI_DATA_DIR)
     return mni_template['t1']
 
-def get_mri_slices(slice_type='axial', num_slices=10):
+@lru_cache(maxsize=1)
+def load_mri_volume():
+    """
+    Load the MRI template volume as a read-only float32 array
+    
+    The volume is loaded once per process and shared by all requests.
+    """
+    # Ensure we have MRI data
+    mri_path = download_sample_mri_data()
+    
+    # Load MRI data
+    mri_img = nib.load(mri_path)
+    mri_data = mri_img.get_fdata(dtype=MRI_DTYPE)
+    mri_data.flags.writeable = False
+    return mri_data
+
+def get_mri_slices(slice_type='axial', num_slices=10, cancel_token=None):
     """
     Get MRI slices for visualization
     
@@ -38,18 +60,15 @@ def get_mri_slices(slice_type='axial', num_slices=10):
         Type of slice ('axial', 'coronal', or 'sagittal')
     num_slices : int
         Number of slices to return
+    cancel_token : CancellationToken, optional
+        Token checked before each slice render
         
     Returns:
     --------
     dict
         Dictionary containing MRI slice data
     """
-    # Ensure we have MRI data
-    mri_path = download_sample_mri_data()
-    
-    # Load MRI data
-    mri_img = nib.load(mri_path)
-    mri_data = mri_img.get_fdata()
+    mri_data = load_mri_volume()
     
     # Get dimensions
     nx, ny, nz = mri_data.shape
@@ -76,9 +95,12 @@ def get_mri_slices(slice_type='axial', num_slices=10):
     # Convert slices to base64 encoded PNGs for web display
     slice_images = []
     for i, slice_data in enumerate(slices):
-        # Normalize slice data to 0-255 range
-        normalized_slice = ((slice_data - slice_data.min()) / 
-                           (slice_data.max() - slice_data.min()) * 255).astype(np.uint8)
+        check_cancelled(cancel_token)
+        
+        # Normalize slice data to 0-255 range (in float32)
+        slice_min, slice_max = slice_data.min(), slice_data.max()
+        scale = 255 / (slice_max - slice_min) if slice_max > slice_min else 0
+        normalized_slice = ((slice_data - slice_min) * MRI_DTYPE(scale)).astype(DISPLAY_DTYPE)
         
         # Create matplotlib figure
         fig, ax = plt.subplots(figsize=(5, 5))
@@ -107,7 +129,7 @@ def get_mri_slices(slice_type='axial', num_slices=10):
         'slices': slice_images
     }
 
-def overlay_activation(mri_data, activation_map):
+def overlay_activation(mri_data, activation_map, overlays=None, cancel_token=None):
     """
     Overlay activation patterns on MRI slices
     
@@ -117,42 +139,84 @@ def overlay_activation(mri_data, activation_map):
         Dictionary containing MRI slice data
     activation_map : dict
         Dictionary containing activation patterns
+    overlays : list, optional
+        Previously rendered overlay images, one per slice, as returned by
+        render_overlays. Rendered from activation_map['voxel_data'] if omitted.
+    cancel_token : CancellationToken, optional
+        Token checked before each overlay render
         
     Returns:
     --------
     dict
         Dictionary containing MRI slices with activation overlays
     """
-    # Get emotion colors for the overlay
-    emotion_colors = get_emotion_colors()
-    
     # Create a copy of the MRI data
     overlay_data = mri_data.copy()
     
-    # Get voxel data from activation map
-    voxel_data = activation_map['voxel_data']
+    if overlays is None:
+        overlays = render_overlays(mri_data, activation_map['voxel_data'], cancel_token)
+    
+    # Load brain region information once for all slices
+    region_info_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 
+                                  'data', 'brain_regions.json')
+    with open(region_info_path, 'r') as f:
+        brain_regions = json.load(f)
+    
+    for slice_info, overlay in zip(overlay_data['slices'], overlays):
+        # Add overlay to slice info
+        slice_info['overlay'] = overlay
+        
+        # Add regions information to the slice
+        # In a real application, this would be based on actual brain atlas data
+        # For now, we'll add a simplified version based on the activation map
+        regions = []
+        for region_name, activation in activation_map['regions'].items():
+            if activation > 0.3:  # Only include regions with significant activation
+                if region_name in brain_regions:
+                    region_info = brain_regions[region_name].copy()
+                    region_info['activation'] = float(activation)
+                    regions.append(region_info)
+        
+        slice_info['regions'] = regions
+    
+    return overlay_data
+
+def render_overlays(mri_data, voxel_data, cancel_token=None):
+    """
+    Render the activation overlay image for every slice of a view
+    
+    Parameters:
+    -----------
+    mri_data : dict
+        Dictionary containing MRI slice data
+    voxel_data : dict
+        Sparse voxel activations from generate_voxel_activations
+    cancel_token : CancellationToken, optional
+        Token checked before each overlay render
+        
+    Returns:
+    --------
+    list
+        Base64 encoded PNG overlay for each slice, in slice order
+    """
+    # Get emotion colors for the overlay
+    emotion_colors = get_emotion_colors()
     
     # Create a 3D grid of activation values
     grid_size = voxel_data['dimensions'][0]
-    activation_grid = np.zeros(voxel_data['dimensions'])
-    
-    for voxel in voxel_data['voxels']:
-        x, y, z = voxel['x'], voxel['y'], voxel['z']
-        activation_grid[x, y, z] = voxel['value']
+    activation_grid = display_grid(voxel_data)
     
     # Get MRI dimensions
     nx, ny, nz = mri_data['dimensions']
     
     # For each slice, create an overlay
-    for slice_info in overlay_data['slices']:
-        slice_index = slice_info['index']
+    overlays = []
+    for slice_info in mri_data['slices']:
+        check_cancelled(cancel_token)
         slice_position = slice_info['position']
         
-        # Get the original slice image
-        img_data = slice_info['image']
-        
         # Create a new overlay based on the orientation
-        if overlay_data['orientation'] == 'axial':
+        if mri_data['orientation'] == 'axial':
             # Map activation grid to MRI space
             z_pos = slice_position
             z_grid = int((z_pos / nz) * grid_size)
@@ -160,7 +224,7 @@ def overlay_activation(mri_data, activation_map):
             # Create overlay
             overlay = create_overlay(activation_grid[:, :, z_grid], emotion_colors)
             
-        elif overlay_data['orientation'] == 'coronal':
+        elif mri_data['orientation'] == 'coronal':
             # Map activation grid to MRI space
             y_pos = slice_position
             y_grid = int((y_pos / ny) * grid_size)
@@ -168,7 +232,7 @@ def overlay_activation(mri_data, activation_map):
             # Create overlay
             overlay = create_overlay(activation_grid[:, y_grid, :], emotion_colors)
             
-        elif overlay_data['orientation'] == 'sagittal':
+        elif mri_data['orientation'] == 'sagittal':
             # Map activation grid to MRI space
             x_pos = slice_position
             x_grid = int((x_pos / nx) * grid_size)
@@ -176,29 +240,24 @@ def overlay_activation(mri_data, activation_map):
             # Create overlay
             overlay = create_overlay(activation_grid[x_grid, :, :], emotion_colors)
         
-        # Add overlay to slice info
-        slice_info['overlay'] = overlay
-        
-        # Add regions information to the slice
-        # In a real application, this would be based on actual brain atlas data
-        # For now, we'll add a simplified version based on the activation map
-        regions = []
-        for region_name, activation in activation_map['regions'].items():
-            if activation > 0.3:  # Only include regions with significant activation
-                # Get region info from brain_regions.json
-                region_info_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 
-                                              'data', 'brain_regions.json')
-                with open(region_info_path, 'r') as f:
-                    brain_regions = json.load(f)
-                
-                if region_name in brain_regions:
-                    region_info = brain_regions[region_name].copy()
-                    region_info['activation'] = float(activation)
-                    regions.append(region_info)
-        
-        slice_info['regions'] = regions
+        overlays.append(overlay)
     
-    return overlay_data
+    return overlays
+
+def display_grid(voxel_data):
+    """
+    Build a dense grid of uint8 display levels from sparse voxel activations
+    
+    Only display resolution is needed for overlays, so values are stored as
+    levels rather than floats.
+    """
+    activation_grid = np.zeros(voxel_data['dimensions'], dtype=DISPLAY_DTYPE)
+    
+    voxels = voxel_data['voxels']
+    if voxels:
+        x, y, z = np.array([(voxel['x'], voxel['y'], voxel['z']) for voxel in voxels]).T
+        activation_grid[x, y, z] = quantize_unit([voxel['value'] for voxel in voxels])
+    return activation_grid
 
 def create_overlay(activation_slice, emotion_colors):
     """
@@ -207,7 +266,8 @@ def create_overlay(activation_slice, emotion_colors):
     Parameters:
     -----------
     activation_slice : numpy.ndarray
-        2D array of activation values
+        2D array of activation values, either uint8 display levels
+        or floats in the 0-1 range
     emotion_colors : dict
         Dictionary mapping emotions to colors
         
@@ -235,8 +295,11 @@ def create_overlay(activation_slice, emotion_colors):
     
     # Set alpha channel based on activation value
     # Scale to 0-255 range with a minimum threshold
-    alpha = (activation_slice * 255).astype(np.uint8)
-    alpha[alpha < 50] = 0  # Threshold to remove low activations
+    if activation_slice.dtype == DISPLAY_DTYPE:
+        alpha = activation_slice.copy()
+    else:
+        alpha = quantize_unit(activation_slice)
+    alpha[alpha < OVERLAY_ALPHA_THRESHOLD] = 0  # Threshold to remove low activations
     overlay[..., 3] = alpha
     
     # Create matplotlib figure
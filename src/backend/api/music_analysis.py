@@ -1,8 +1,33 @@
 import librosa
 import numpy as np
+import soundfile as sf
+from math import gcd
+from scipy.signal import resample_poly
 from sklearn.preprocessing import MinMaxScaler
 import os
 import json
+from api.precision import AUDIO_DTYPE, FEATURE_DTYPE
+from api.segment_index import SegmentFeatureIndex
+from api.cancellation import check_cancelled
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+# Sample rate used for all analysis
+TARGET_SR = 22050
+
+# Largest up/down factor for which polyphase resampling is used
+# Ratios that reduce to larger factors fall back to librosa's resampler
+MAX_POLYPHASE_FACTOR = 1000
+
+# Number of frames decoded and downmixed per chunk
+DECODE_CHUNK_FRAMES = 262144
+
+# Number of frames per chunk for the polyphase fallback resampler
+# (about 90 s at 44.1 kHz; larger chunks amortize the filter setup)
+RESAMPLE_CHUNK_FRAMES = 4194304
 
 # Define emotion categories and their associated musical features
 EMOTION_FEATURES = {
@@ -38,7 +63,7 @@ EMOTION_FEATURES = {
     }
 }
 
-def analyze_music_emotion(audio_path):
+def analyze_music_emotion(audio_path, cancel_token=None):
     """
     Analyze music file and extract emotional characteristics
     
@@ -46,6 +71,8 @@ def analyze_music_emotion(audio_path):
     -----------
     audio_path : str
         Path to the audio file
+    cancel_token : CancellationToken, optional
+        Token checked between units of work to stop abandoned requests
         
     Returns:
     --------
@@ -53,37 +80,216 @@ def analyze_music_emotion(audio_path):
         Dictionary containing emotion scores and musical features
     """
     # Load audio file
-    y, sr = librosa.load(audio_path, sr=22050)
+    y, audio_info = decode_audio(audio_path)
+    
+    check_cancelled(cancel_token)
+    result = analyze_audio(y, audio_info['sr'], cancel_token=cancel_token)
+    result['audio'] = audio_info
+    return result
+
+def load_audio(audio_path, sr=TARGET_SR):
+    """
+    Decode an audio file to a mono signal at the analysis sample rate
+    """
+    y, audio_info = decode_audio(audio_path, sr)
+    return y, audio_info['sr']
+
+def decode_audio(audio_path, sr=TARGET_SR):
+    """
+    Decode an audio file with the first registered decoder that can read it
+    
+    Parameters:
+    -----------
+    audio_path : str
+        Path to the audio file
+    sr : int
+        Target sample rate
+        
+    Returns:
+    --------
+    tuple
+        Mono float32 signal and a dict describing the decoder and resampler
+        used, the source sample rate and the output sample rate
+    """
+    extension = os.path.splitext(audio_path)[1].lower()
+    errors = []
+    
+    for decoder in AUDIO_DECODERS:
+        if decoder['extensions'] is not None and extension not in decoder['extensions']:
+            continue
+        try:
+            y, source_sr = decoder['decode'](audio_path)
+        except Exception as e:
+            errors.append(f"{decoder['name']}: {e}")
+            continue
+        
+        y, resampler = resample_audio(y, source_sr, sr)
+        return y, {
+            'decoder': decoder['name'],
+            'resampler': resampler,
+            'source_sr': int(source_sr),
+            'sr': int(sr),
+            'duration': len(y) / sr
+        }
+    
+    raise ValueError(f"Could not decode {os.path.basename(audio_path)}: " + '; '.join(errors))
+
+def register_decoder(name, decode, extensions=None):
+    """
+    Register an audio decoder
+    
+    Decoders are tried in registration order. decode(audio_path) must return
+    a mono float32 signal and its sample rate; extensions limits the decoder
+    to files with those (lowercase) extensions, or None for any file.
+    """
+    AUDIO_DECODERS.append({
+        'name': name,
+        'decode': decode,
+        'extensions': extensions
+    })
+
+def decode_soundfile(audio_path):
+    """
+    Decode with libsndfile, downmixing to mono one chunk at a time
+    """
+    with sf.SoundFile(audio_path) as f:
+        source_sr = f.samplerate
+        y = np.empty(f.frames, dtype=AUDIO_DTYPE)
+        position = 0
+        for block in f.blocks(blocksize=DECODE_CHUNK_FRAMES, dtype='float32', always_2d=True):
+            y[position:position + len(block)] = block.mean(axis=1)
+            position += len(block)
+    return y[:position], source_sr
+
+def decode_librosa(audio_path):
+    """
+    Decode with librosa's generic loader (audioread fallback for other formats)
+    """
+    return librosa.load(audio_path, sr=None, mono=True, dtype=AUDIO_DTYPE)
+
+AUDIO_DECODERS = []
+register_decoder('soundfile', decode_soundfile, extensions=('.wav', '.flac', '.ogg'))
+register_decoder('librosa', decode_librosa)
+
+def resample_audio(y, source_sr, sr):
+    """
+    Resample a mono signal
+    
+    Uses the SoX resampler (the same filter as librosa's default 'soxr_hq')
+    when python-soxr is installed, which works in float32 and is several
+    times faster than polyphase filtering. Otherwise rational ratios use
+    chunked polyphase filtering and other ratios librosa's resampler.
+    
+    Returns the resampled float32 signal and the name of the resampler used
+    ('none', 'soxr', 'polyphase' or 'librosa').
+    """
+    y = np.asarray(y, dtype=AUDIO_DTYPE)
+    if source_sr == sr:
+        return y, 'none'
+    
+    if soxr is not None:
+        return soxr.resample(y, source_sr, sr, quality='HQ'), 'soxr'
+    
+    divisor = gcd(int(source_sr), int(sr))
+    up, down = int(sr) // divisor, int(source_sr) // divisor
+    if max(up, down) > MAX_POLYPHASE_FACTOR:
+        resampled = librosa.resample(y, orig_sr=source_sr, target_sr=sr)
+        return resampled.astype(AUDIO_DTYPE, copy=False), 'librosa'
+    
+    return _resample_poly_chunked(y, up, down), 'polyphase'
+
+def _resample_poly_chunked(y, up, down, chunk_frames=RESAMPLE_CHUNK_FRAMES):
+    """
+    Polyphase resampling in chunks with float32 output
+    
+    Each chunk is filtered together with enough neighbouring samples to cover
+    the anti-aliasing filter, so the result matches resampling the whole
+    signal at once while only chunk-sized float64 temporaries are allocated.
+    """
+    # Chunk boundaries and margins are multiples of down so that every chunk
+    # starts on an exact output sample
+    half_filter = 10 * max(up, down) // up + 1
+    margin = -(-half_filter // down) * down
+    chunk_frames = max(chunk_frames // down, 1) * down
+    
+    num_out = -(-len(y) * up // down)
+    out = np.empty(num_out, dtype=AUDIO_DTYPE)
+    
+    for start in range(0, len(y), chunk_frames):
+        end = min(start + chunk_frames, len(y))
+        padded_start = max(start - margin, 0)
+        padded_end = min(end + margin, len(y))
+        
+        resampled = resample_poly(y[padded_start:padded_end], up, down)
+        
+        out_start = start * up // down
+        out_end = num_out if end == len(y) else end * up // down
+        offset = (start - padded_start) * up // down
+        out[out_start:out_end] = resampled[offset:offset + out_end - out_start]
+    
+    return out
+
+def analyze_audio(y, sr, segment_duration=3.0, hop=None, segment_index=None, cancel_token=None):
+    """
+    Extract emotional characteristics from a decoded audio signal
+    
+    Parameters:
+    -----------
+    y : numpy.ndarray
+        Mono audio signal
+    sr : int
+        Sample rate of the signal
+    segment_duration : float
+        Length of the time segments in seconds
+    hop : float, optional
+        Time between segment starts in seconds (defaults to segment_duration)
+    segment_index : SegmentFeatureIndex, optional
+        Prebuilt frame-level feature index for the signal
+    cancel_token : CancellationToken, optional
+        Token checked between units of work to stop abandoned requests
+        
+    Returns:
+    --------
+    dict
+        Dictionary containing emotion scores and musical features
+    """
+    y = np.asarray(y, dtype=AUDIO_DTYPE)
+    
+    # Extract frame-level features once; whole-track and per-segment
+    # features are aggregated from the same index
+    if segment_index is None:
+        segment_index = SegmentFeatureIndex.from_audio(y, sr, cancel_token=cancel_token)
+    overall = segment_index.aggregate(0.0, segment_index.duration)
     
-    # Extract musical features
     # Tempo (BPM)
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    tempo = segment_index.tempo
     
     # Spectral features
-    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr).mean()
+    spectral_centroid = overall['spectral_centroid']
     spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr).mean()
     
     # Harmonic features
-    harmonic = librosa.effects.harmonic(y)
-    chroma = librosa.feature.chroma_cqt(y=harmonic, sr=sr).mean(axis=1)
+    chroma = overall['chroma'].astype(FEATURE_DTYPE)
     
     # MFCC features
+    check_cancelled(cancel_token)
     mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
     mfcc_mean = mfcc.mean(axis=1)
     
     # Energy
-    energy = np.sum(y**2) / len(y)
+    energy = overall['energy']
     
     # Estimate key and mode (major/minor)
     key = np.argmax(chroma)
-    mode_feature = estimate_mode(y, sr)
+    mode_feature = mode_from_chroma(chroma)
     mode = "major" if mode_feature > 0.5 else "minor"
     
     # Map features to emotion scores
     emotion_scores = calculate_emotion_scores(tempo, mode, energy, spectral_centroid)
     
     # Create segments for time-based emotion analysis
-    segments = create_time_segments(y, sr)
+    segments = create_time_segments(y, sr, segment_duration, hop, segment_index=segment_index,
+                                    cancel_token=cancel_token)
     
     return {
         'overall_emotions': emotion_scores,
@@ -93,42 +299,62 @@ def analyze_music_emotion(audio_path):
             'mode': mode,
             'energy': float(energy),
             'spectral_centroid': float(spectral_centroid),
-            'key': int(key)
+            'key': int(key),
+            'chroma': [float(c) for c in chroma],
+            'mfcc': [float(m) for m in mfcc_mean]
         }
     }
 
-def estimate_mode(y, sr):
+def estimate_mode(y, sr, chroma=None):
     """
     Estimate if the music is in major or minor mode
     Returns value between 0 (minor) and 1 (major)
+    
+    A precomputed chromagram of the harmonic signal can be passed to avoid
+    recomputing it
     """
     # This is a simplified approach - in a real application, 
     # we would use more sophisticated harmonic analysis
-    harmonic = librosa.effects.harmonic(y)
-    chroma = librosa.feature.chroma_cqt(y=harmonic, sr=sr)
+    if chroma is None:
+        harmonic = librosa.effects.harmonic(y)
+        chroma = librosa.feature.chroma_cqt(y=harmonic, sr=sr).astype(FEATURE_DTYPE, copy=False)
     
-    # Major and minor chord templates
-    major_template = np.array([1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0])
-    minor_template = np.array([1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0])
-    
-    # Rotate and correlate with templates
-    major_corr = []
-    minor_corr = []
-    
-    for i in range(12):
-        rolled_chroma = np.roll(chroma.mean(axis=1), i)
-        major_corr.append(np.corrcoef(rolled_chroma, major_template)[0, 1])
-        minor_corr.append(np.corrcoef(rolled_chroma, minor_template)[0, 1])
+    return float(mode_from_chroma(chroma.mean(axis=1)))
+
+# Major and minor chord templates
+MAJOR_TEMPLATE = np.array([1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0], dtype=FEATURE_DTYPE)
+MINOR_TEMPLATE = np.array([1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0], dtype=FEATURE_DTYPE)
+
+def _standardize(values):
+    """
+    Zero-mean, unit-variance scaling along the last axis
+    """
+    values = np.asarray(values, dtype=np.float64)
+    centered = values - values.mean(axis=-1, keepdims=True)
+    std = centered.std(axis=-1, keepdims=True)
+    return centered / np.where(std > 0, std, np.inf)
+
+# All 12 rotations of each template, standardized for Pearson correlation
+_MAJOR_ROTATIONS = _standardize([np.roll(MAJOR_TEMPLATE, -i) for i in range(12)])
+_MINOR_ROTATIONS = _standardize([np.roll(MINOR_TEMPLATE, -i) for i in range(12)])
+
+def mode_from_chroma(chroma):
+    """
+    Estimate mode from mean chroma vectors
     
-    # Compare best major correlation with best minor correlation
-    max_major_corr = max(major_corr)
-    max_minor_corr = max(minor_corr)
+    Correlates each 12-bin chroma vector with every rotation of the major and
+    minor templates. Accepts a single vector or a (num_windows, 12) array and
+    returns values between 0 (minor) and 1 (major).
+    """
+    z = _standardize(chroma)
     
-    # Return value between 0 (minor) and 1 (major)
-    if max_major_corr + max_minor_corr == 0:
-        return 0.5  # Neutral if no correlation
+    # Best correlation over all rotations
+    max_major_corr = (z @ _MAJOR_ROTATIONS.T).max(axis=-1) / 12
+    max_minor_corr = (z @ _MINOR_ROTATIONS.T).max(axis=-1) / 12
     
-    return max_major_corr / (max_major_corr + max_minor_corr)
+    # Return value between 0 (minor) and 1 (major), neutral if no correlation
+    total = max_major_corr + max_minor_corr
+    return np.where(total == 0, 0.5, max_major_corr / np.where(total == 0, 1, total))
 
 def calculate_emotion_scores(tempo, mode, energy, spectral_centroid):
     """
@@ -161,39 +387,43 @@ def calculate_emotion_scores(tempo, mode, energy, spectral_centroid):
         'tense': float(tense_score / total)
     }
 
-def create_time_segments(y, sr, segment_duration=3.0):
+def create_time_segments(y, sr, segment_duration=3.0, hop=None, segment_index=None,
+                         start_time=0.0, end_time=None, cancel_token=None):
     """
     Create time-based segments for emotion analysis throughout the song
+    
+    Segment features are aggregated from a prefix-sum index of frame-level
+    features, so any segment length, overlapping hop or time range costs
+    O(1) per segment once the index exists.
     """
-    # Calculate number of segments
-    total_duration = len(y) / sr
-    num_segments = int(total_duration / segment_duration)
+    if segment_index is None:
+        segment_index = SegmentFeatureIndex.from_audio(y, sr, cancel_token=cancel_token)
+    
+    starts, ends = segment_index.windows(segment_duration, hop, start_time, end_time)
+    window = segment_index.aggregate_windows(starts, ends)
+    mode_features = mode_from_chroma(window['chroma'])
     
     segments = []
     
-    for i in range(num_segments):
-        start_sample = int(i * segment_duration * sr)
-        end_sample = int((i + 1) * segment_duration * sr)
-        
-        # Get segment audio
-        segment_y = y[start_sample:end_sample]
-        
-        # Extract features for this segment
-        tempo, _ = librosa.beat.beat_track(y=segment_y, sr=sr)
-        energy = np.sum(segment_y**2) / len(segment_y)
-        spectral_centroid = librosa.feature.spectral_centroid(y=segment_y, sr=sr).mean()
-        
-        # Estimate mode for segment
-        mode_feature = estimate_mode(segment_y, sr)
-        mode = "major" if mode_feature > 0.5 else "minor"
+    for i in range(len(starts)):
+        check_cancelled(cancel_token)
+        mode = "major" if mode_features[i] > 0.5 else "minor"
         
         # Calculate emotion scores for segment
-        emotion_scores = calculate_emotion_scores(tempo, mode, energy, spectral_centroid)
+        emotion_scores = calculate_emotion_scores(window['tempo'][i], mode, window['energy'][i],
+                                                  window['spectral_centroid'][i])
         
         segments.append({
-            'start_time': i * segment_duration,
-            'end_time': (i + 1) * segment_duration,
-            'emotions': emotion_scores
+            'start_time': float(starts[i]),
+            'end_time': float(ends[i]),
+            'emotions': emotion_scores,
+            'features': {
+                'tempo': float(window['tempo'][i]),
+                'mode': mode,
+                'energy': float(window['energy'][i]),
+                'spectral_centroid': float(window['spectral_centroid'][i]),
+                'onset_strength': float(window['onset_strength'][i])
+            }
         })
     
     return segments
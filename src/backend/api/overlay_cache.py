@@ -0,0 +1,179 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Path to store rendered overlay sets
+OVERLAY_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'overlay_cache')
+
+# Default quantization step for region activations (which are in the 0-1 range)
+DEFAULT_QUANTIZATION_STEP = 0.05
+
+class OverlayCache:
+    """
+    Two-level LRU cache of rendered overlay sets
+
+    Overlays depend only on the normalized region activations, so the cache
+    key is the activation vector quantized to multiples of step. Overlays are
+    always rendered from the quantized vector, which makes a cached entry
+    exactly what the key describes.
+
+    Quantization error: every region activation moves by at most step / 2.
+    Callers must keep the sphere radii of the exact activations (pass them as
+    part of the key, see sphere_radii) because a radius is truncated to whole
+    voxels and one voxel more or less changes nearby values by up to 0.2.
+    With fixed radii, voxel values scale linearly with their region's
+    activation and also move by at most step / 2. At the default step of 0.05
+    that is 0.025, at most 7 of the 255 overlay alpha levels; only voxels
+    within 7 levels of the display threshold can appear or disappear.
+
+    Parameters:
+    -----------
+    cache_dir : str
+        Directory for the on-disk level (None for memory only)
+    step : float
+        Quantization step for region activations
+    max_entries : int
+        Number of overlay sets kept in memory
+    max_disk_entries : int
+        Number of overlay sets kept on disk
+    """
+    def __init__(self, cache_dir=OVERLAY_CACHE_DIR, step=DEFAULT_QUANTIZATION_STEP,
+                 max_entries=32, max_disk_entries=1024):
+        if step <= 0:
+            raise ValueError("Quantization step must be positive")
+        self.cache_dir = cache_dir
+        self.step = step
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def quantize(self, region_activations):
+        """
+        Snap region activations to the nearest multiple of the quantization step
+        """
+        return {region: min(round(activation / self.step) * self.step, 1.0)
+                for region, activation in region_activations.items()}
+
+    def key(self, region_activations, **variant):
+        """
+        Build the cache key for a set of region activations
+
+        Keyword arguments describe anything else the rendering depends on
+        (view types, slice count, grid size) and become part of the key.
+        """
+        levels = {region: int(round(activation / self.step))
+                  for region, activation in sorted(region_activations.items())}
+        payload = json.dumps({'step': self.step, 'levels': levels, 'variant': variant},
+                             sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Look up an overlay set, returning None on a miss
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key]
+
+        overlays = self._read_disk(key)
+
+        with self._lock:
+            if overlays is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, overlays)
+        return overlays
+
+    def put(self, key, overlays):
+        """
+        Store an overlay set in memory and on disk
+        """
+        with self._lock:
+            self._remember(key, overlays)
+        self._write_disk(key, overlays)
+
+    def _remember(self, key, overlays):
+        # Called with the lock held
+        self._entries[key] = overlays
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                overlays = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Refresh the modification time so disk eviction is least-recently-used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return overlays
+
+    def _write_disk(self, key, overlays):
+        if self.cache_dir is None:
+            return
+        # Write to a temporary file first so readers never see a partial entry
+        path = self._disk_path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(overlays, f)
+        os.replace(temp_path, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """
+        Remove the least recently used entries beyond max_disk_entries
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        Get hit/miss counters and the overall hit rate
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'step': self.step,
+                'entries': len(self._entries),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
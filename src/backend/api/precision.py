@@ -0,0 +1,29 @@
+import numpy as np
+
+# Precision policy for the analysis pipeline
+# Audio, features, the MRI volume and activation grids are computed in float32;
+# anything that only ends up as pixels is stored as 8-bit display values.
+AUDIO_DTYPE = np.float32
+FEATURE_DTYPE = np.float32
+MRI_DTYPE = np.float32
+ACTIVATION_DTYPE = np.float32
+DISPLAY_DTYPE = np.uint8
+
+# Number of display levels for values in the 0-1 range
+DISPLAY_LEVELS = 255
+
+def quantize_unit(values):
+    """
+    Quantize values in the 0-1 range to uint8 display levels
+    
+    Values are rounded to the nearest level, so the error introduced is at
+    most 0.5 / DISPLAY_LEVELS (about 0.002).
+    """
+    values = np.clip(np.asarray(values, dtype=ACTIVATION_DTYPE), 0, 1)
+    return np.rint(values * DISPLAY_LEVELS).astype(DISPLAY_DTYPE)
+
+def dequantize_unit(levels):
+    """
+    Convert uint8 display levels back to float32 values in the 0-1 range
+    """
+    return np.asarray(levels, dtype=ACTIVATION_DTYPE) / DISPLAY_LEVELS
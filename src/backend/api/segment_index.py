@@ -0,0 +1,266 @@
+import os
+import re
+import numpy as np
+import librosa
+from api.precision import AUDIO_DTYPE, FEATURE_DTYPE
+from api.cancellation import check_cancelled
+
+# Path to store per-track segment indexes
+SEGMENT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'segments')
+
+# Frame hop used for all frame-level features (about 23 ms at 22050 Hz)
+DEFAULT_HOP_LENGTH = 512
+
+# Shortest window length and hop accepted for a segment timeline
+MIN_WINDOW_SECONDS = 0.1
+
+# Number of segment indexes kept on disk before the least recently used are removed
+MAX_SEGMENT_INDEXES = 512
+
+TRACK_ID_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
+def segment_index_path(track_id):
+    """
+    Get the path of the stored segment index for a track
+    """
+    if not TRACK_ID_PATTERN.match(track_id):
+        raise ValueError(f"Invalid track id: {track_id}")
+    return os.path.join(SEGMENT_DATA_DIR, f"{track_id}.npz")
+
+def evict_segment_indexes(max_indexes=MAX_SEGMENT_INDEXES, data_dir=SEGMENT_DATA_DIR):
+    """
+    Remove the least recently used segment indexes beyond max_indexes
+
+    Loading an index refreshes its modification time, so the indexes that
+    are removed are the ones that were neither written nor read recently.
+    """
+    if not os.path.isdir(data_dir):
+        return
+    entries = []
+    for name in os.listdir(data_dir):
+        if name.endswith('.npz'):
+            path = os.path.join(data_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+    if len(entries) <= max_indexes:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - max_indexes]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _prefix_sum(values):
+    """
+    Cumulative sum along the first axis with a leading zero row
+
+    Sums are accumulated in float64 so that differences of large running
+    totals stay accurate; this is the one deliberate exception to the
+    float32 precision policy.
+    """
+    values = np.asarray(values)
+    zero = np.zeros((1,) + values.shape[1:], dtype=np.float64)
+    return np.concatenate([zero, np.cumsum(values, axis=0, dtype=np.float64)])
+
+class SegmentFeatureIndex:
+    """
+    Prefix-sum index over frame-level audio features
+
+    Built once per track from the frame-level energy, spectral centroid,
+    chroma and onset strength, it aggregates any time window in O(1), so
+    timelines with arbitrary window length and hop (including overlapping
+    windows) need no further decoding or feature extraction.
+    """
+    def __init__(self, sr, hop_length, num_samples, tempo, beat_times,
+                 energy_cumsum, centroid_cumsum, onset_cumsum, chroma_cumsum):
+        self.sr = int(sr)
+        self.hop_length = int(hop_length)
+        self.num_samples = int(num_samples)
+        self.tempo = float(tempo)
+        self.beat_times = np.asarray(beat_times, dtype=np.float64)
+        self.energy_cumsum = energy_cumsum
+        self.centroid_cumsum = centroid_cumsum
+        self.onset_cumsum = onset_cumsum
+        self.chroma_cumsum = chroma_cumsum
+
+    @property
+    def duration(self):
+        return self.num_samples / self.sr
+
+    @property
+    def num_frames(self):
+        return len(self.centroid_cumsum) - 1
+
+    @classmethod
+    def from_audio(cls, y, sr, hop_length=DEFAULT_HOP_LENGTH, cancel_token=None):
+        """
+        Extract frame-level features from an audio signal and index them
+
+        Parameters:
+        -----------
+        y : numpy.ndarray
+            Mono audio signal
+        sr : int
+            Sample rate of the signal
+        hop_length : int
+            Number of samples between frames
+        cancel_token : CancellationToken, optional
+            Token checked between feature extractions
+
+        Returns:
+        --------
+        SegmentFeatureIndex
+        """
+        y = np.asarray(y, dtype=AUDIO_DTYPE)
+
+        # Onset strength drives both the onset feature and beat tracking
+        onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+        tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr,
+                                                     hop_length=hop_length)
+        beat_times = librosa.frames_to_time(beat_frames, sr=sr, hop_length=hop_length)
+
+        check_cancelled(cancel_token)
+        centroid = librosa.feature.spectral_centroid(y=y, sr=sr, hop_length=hop_length)[0]
+
+        check_cancelled(cancel_token)
+        harmonic = librosa.effects.harmonic(y)
+        chroma = librosa.feature.chroma_cqt(y=harmonic, sr=sr, hop_length=hop_length)
+        del harmonic
+        check_cancelled(cancel_token)
+
+        # Energy is summed over non-overlapping hop-sized blocks of samples
+        full = len(y) // hop_length * hop_length
+        block_energy = np.square(y[:full]).reshape(-1, hop_length).sum(axis=1, dtype=np.float64)
+        if full < len(y):
+            block_energy = np.append(block_energy, np.sum(np.square(y[full:]), dtype=np.float64))
+
+        return cls(sr, hop_length, len(y), np.atleast_1d(tempo)[0], beat_times,
+                   _prefix_sum(block_energy),
+                   _prefix_sum(centroid),
+                   _prefix_sum(onset_env),
+                   _prefix_sum(chroma.T.astype(FEATURE_DTYPE, copy=False)))
+
+    def save(self, path):
+        """
+        Save the index to an .npz file
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path,
+                 sr=self.sr,
+                 hop_length=self.hop_length,
+                 num_samples=self.num_samples,
+                 tempo=self.tempo,
+                 beat_times=self.beat_times,
+                 energy_cumsum=self.energy_cumsum,
+                 centroid_cumsum=self.centroid_cumsum,
+                 onset_cumsum=self.onset_cumsum,
+                 chroma_cumsum=self.chroma_cumsum)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved with save()
+        """
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(int(data['sr']), int(data['hop_length']), int(data['num_samples']),
+                        float(data['tempo']), data['beat_times'],
+                        data['energy_cumsum'], data['centroid_cumsum'],
+                        data['onset_cumsum'], data['chroma_cumsum'])
+        # Refresh the modification time so eviction is least-recently-used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return index
+
+    def windows(self, segment_duration, hop=None, start_time=0.0, end_time=None):
+        """
+        Get the start and end times of a sliding window timeline
+
+        Windows of segment_duration seconds start every hop seconds
+        (non-overlapping when hop is None) and only windows that fit
+        completely inside the requested time range are returned.
+        """
+        if hop is None:
+            hop = segment_duration
+        if end_time is None:
+            end_time = self.duration
+        if not np.all(np.isfinite([segment_duration, hop, start_time, end_time])):
+            raise ValueError("Segment times must be finite")
+        if segment_duration < MIN_WINDOW_SECONDS or hop < MIN_WINDOW_SECONDS:
+            raise ValueError(f"Segment duration and hop must be at least {MIN_WINDOW_SECONDS} s")
+
+        end_time = min(end_time, self.duration)
+        start_time = max(start_time, 0.0)
+
+        num_windows = int(np.floor((end_time - start_time - segment_duration) / hop + 1e-9)) + 1
+        starts = start_time + hop * np.arange(max(num_windows, 0))
+        return starts, starts + segment_duration
+
+    def aggregate(self, start_time, end_time):
+        """
+        Aggregate the indexed features over a single time range
+        """
+        window = self.aggregate_windows([start_time], [end_time])
+        return {name: values[0] for name, values in window.items()}
+
+    def aggregate_windows(self, starts, ends):
+        """
+        Aggregate the indexed features over many time ranges at once
+
+        Parameters:
+        -----------
+        starts, ends : array-like
+            Window start and end times in seconds
+
+        Returns:
+        --------
+        dict
+            Arrays of per-window tempo, energy, spectral centroid,
+            onset strength and mean chroma
+        """
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        frames_per_second = self.sr / self.hop_length
+
+        # Feature frames whose centres fall inside the window, at least one
+        f0 = np.clip(np.ceil(starts * frames_per_second), 0, self.num_frames - 1).astype(int)
+        f1 = np.clip(np.ceil(ends * frames_per_second), f0 + 1, self.num_frames).astype(int)
+        frame_counts = f1 - f0
+
+        # Energy blocks covering the window, normalized by their sample count
+        num_blocks = len(self.energy_cumsum) - 1
+        b0 = np.clip(np.floor(starts * frames_per_second), 0, num_blocks - 1).astype(int)
+        b1 = np.clip(np.ceil(ends * frames_per_second), b0 + 1, num_blocks).astype(int)
+        samples = np.minimum(b1 * self.hop_length, self.num_samples) - b0 * self.hop_length
+
+        return {
+            'tempo': self._window_tempo(starts, ends),
+            'energy': (self.energy_cumsum[b1] - self.energy_cumsum[b0]) / samples,
+            'spectral_centroid': (self.centroid_cumsum[f1] - self.centroid_cumsum[f0]) / frame_counts,
+            'onset_strength': (self.onset_cumsum[f1] - self.onset_cumsum[f0]) / frame_counts,
+            'chroma': (self.chroma_cumsum[f1] - self.chroma_cumsum[f0]) / frame_counts[:, None]
+        }
+
+    def _window_tempo(self, starts, ends):
+        """
+        Local tempo from the beats spanning each window
+
+        The beat just before the window and the beat just after it are
+        included so that windows shorter than a beat still get a tempo.
+        Falls back to the global tempo where fewer than two beats exist.
+        """
+        tempo = np.full(len(starts), self.tempo)
+        if len(self.beat_times) < 2:
+            return tempo
+
+        last = len(self.beat_times) - 1
+        i0 = np.clip(np.searchsorted(self.beat_times, starts, side='right') - 1, 0, last)
+        i1 = np.clip(np.searchsorted(self.beat_times, ends, side='left'), 0, last)
+        span = self.beat_times[i1] - self.beat_times[i0]
+        valid = (i1 > i0) & (span > 0)
+        tempo[valid] = 60.0 * (i1[valid] - i0[valid]) / span[valid]
+        return tempo
@@ -0,0 +1,408 @@
+import os
+import json
+import threading
+from array import array
+from contextlib import contextmanager
+import numpy as np
+from api.brain_mapping import BRAIN_REGION_COORDINATES
+
+try:
+    import fcntl
+except ImportError:
+    # No inter-process locking on Windows, where the server runs as a single process
+    fcntl = None
+
+# Path to store the persistent track vector store
+SIMILARITY_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'similarity')
+
+# Layout of a track's feature vector
+# Scalar features, 12 chroma bins, 13 MFCC means and the region activation vector
+SCALAR_FEATURES = ['tempo', 'energy', 'spectral_centroid']
+NUM_CHROMA = 12
+NUM_MFCC = 13
+REGION_NAMES = sorted(BRAIN_REGION_COORDINATES.keys())
+FEATURE_DIM = len(SCALAR_FEATURES) + NUM_CHROMA + NUM_MFCC + len(REGION_NAMES)
+
+# Relative weight of the brain activation block, so that "lights up the brain
+# like this one" dominates over timbre when ranking neighbours
+ACTIVATION_WEIGHT = 2.0
+
+# Below this many tracks a brute-force scan is both exact and fast enough
+EXACT_SEARCH_LIMIT = 20000
+
+# Inverted-file (IVF) index parameters
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_MAX_SAMPLE = 100000
+
+INITIAL_CAPACITY = 1024
+SCAN_CHUNK_ROWS = 262144
+
+def build_feature_vector(emotion_data, region_activations):
+    """
+    Build the similarity feature vector for an analyzed track
+
+    Parameters:
+    -----------
+    emotion_data : dict
+        Output of analyze_music_emotion
+    region_activations : dict
+        Normalized region activations from map_emotion_to_brain
+
+    Returns:
+    --------
+    numpy.ndarray
+        Unit-length float32 vector of length FEATURE_DIM
+    """
+    features = emotion_data['features']
+
+    # Same normalization as calculate_emotion_scores
+    scalars = np.array([
+        min(features['tempo'] / 180.0, 1.0),
+        min(features['energy'] * 100, 1.0),
+        min(features['spectral_centroid'] / 2000.0, 1.0)
+    ], dtype=np.float32) / np.sqrt(len(SCALAR_FEATURES))
+
+    chroma = _unit(np.asarray(features['chroma'], dtype=np.float32))
+    mfcc = _unit(np.asarray(features['mfcc'], dtype=np.float32))
+    regions = _unit(np.array([region_activations[name] for name in REGION_NAMES],
+                             dtype=np.float32)) * ACTIVATION_WEIGHT
+
+    return _unit(np.concatenate([scalars, chroma, mfcc, regions]))
+
+def _unit(vector):
+    """
+    Scale a vector (or each row of a matrix) to unit length
+    """
+    norm = np.linalg.norm(vector, axis=-1, keepdims=True)
+    return vector / np.where(norm > 0, norm, 1)
+
+def _top_k(scores, k):
+    """
+    Return the indices of the k highest scores, best first
+    """
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+class TrackIndex:
+    """
+    Persistent nearest-neighbour index over per-track feature vectors
+
+    Vectors live in a memory-mapped float32 matrix (vectors.f32) with a
+    parallel id table (ids.jsonl). Small collections are searched exactly;
+    once the collection reaches EXACT_SEARCH_LIMIT tracks a spherical k-means
+    coarse quantizer is trained and queries only scan the nprobe closest
+    inverted lists. New tracks are assigned to their nearest list on insert,
+    so the index never needs a full rebuild to stay searchable.
+
+    Several processes (e.g. gunicorn workers) can share one store: every
+    operation holds a file lock on ids.jsonl and first picks up the tracks
+    and training written by other processes. A track that another process
+    moved to a different inverted list stays in its old list here until
+    the index is reopened, which only affects approximate search.
+    """
+
+    def __init__(self, data_dir=SIMILARITY_DATA_DIR, dim=FEATURE_DIM, nprobe=DEFAULT_NPROBE):
+        self.data_dir = data_dir
+        self.dim = dim
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+
+        os.makedirs(data_dir, exist_ok=True)
+        self._vectors_path = os.path.join(data_dir, 'vectors.f32')
+        self._assignments_path = os.path.join(data_dir, 'assignments.i32')
+        self._ids_path = os.path.join(data_dir, 'ids.jsonl')
+        self._centroids_path = os.path.join(data_dir, 'centroids.npy')
+
+        self._load()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _load(self):
+        """
+        Open the on-disk store, creating it if necessary
+        """
+        self._ids = []
+        self._names = []
+        self._rows = {}
+        self._ids_offset = 0
+        self._centroids = None
+        self._centroids_version = None
+        self._lists = []
+
+        with self._store_lock(exclusive=True):
+            self._read_ids()
+
+            capacity = INITIAL_CAPACITY
+            if os.path.exists(self._vectors_path):
+                capacity = max(capacity, os.path.getsize(self._vectors_path) // (self.dim * 4))
+            self._open_maps(max(capacity, len(self._ids)))
+            self._load_centroids()
+
+    @contextmanager
+    def _store_lock(self, exclusive):
+        """
+        Lock the on-disk store against other processes sharing it
+        """
+        with open(self._ids_path, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _read_ids(self):
+        """
+        Read id table entries appended since the last read
+        """
+        with open(self._ids_path, 'rb') as f:
+            f.seek(self._ids_offset)
+            for line in f:
+                # Appends happen under the exclusive lock, so lines are complete
+                self._ids_offset += len(line)
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    self._rows[entry['id']] = len(self._ids)
+                    self._ids.append(entry['id'])
+                    self._names.append(entry.get('name'))
+
+    def _load_centroids(self):
+        """
+        Load the coarse quantizer if it exists and changed since it was last loaded
+        """
+        try:
+            stat = os.stat(self._centroids_path)
+        except FileNotFoundError:
+            return
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self._centroids_version:
+            return
+        self._centroids = np.load(self._centroids_path).astype(np.float32)
+        self._centroids_version = version
+        self._rebuild_lists()
+
+    def _sync(self):
+        """
+        Pick up tracks and training written by other processes
+
+        Called with both locks held.
+        """
+        count = len(self._ids)
+        self._read_ids()
+        self._ensure_capacity(len(self._ids))
+
+        version = self._centroids_version
+        self._load_centroids()
+        if self._centroids is not None and self._centroids_version == version:
+            for row in range(count, len(self._ids)):
+                self._lists[self._assignments[row]].append(row)
+
+    def _open_maps(self, capacity):
+        """
+        Memory-map the vector matrix and list assignments with the given row capacity
+        """
+        for path, itemsize in ((self._vectors_path, self.dim * 4), (self._assignments_path, 4)):
+            with open(path, 'ab') as f:
+                if f.tell() < capacity * itemsize:
+                    f.truncate(capacity * itemsize)
+
+        self._capacity = capacity
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+',
+                                  shape=(capacity, self.dim))
+        self._assignments = np.memmap(self._assignments_path, dtype=np.int32, mode='r+',
+                                      shape=(capacity,))
+
+    def _ensure_capacity(self, rows):
+        """
+        Grow the memory-mapped files geometrically so appends stay amortized O(1)
+        """
+        if rows <= self._capacity:
+            return
+        self._vectors.flush()
+        self._assignments.flush()
+        capacity = self._capacity
+        while capacity < rows:
+            capacity *= 2
+        del self._vectors, self._assignments
+        self._open_maps(capacity)
+
+    def _rebuild_lists(self):
+        """
+        Rebuild the in-memory inverted lists from the persisted assignments
+        """
+        self._lists = [array('i') for _ in range(len(self._centroids))]
+        assignments = np.asarray(self._assignments[:len(self._ids)])
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(len(self._centroids) + 1))
+        for list_id in range(len(self._centroids)):
+            self._lists[list_id].extend(order[bounds[list_id]:bounds[list_id + 1]].tolist())
+
+    def add(self, track_id, vector, name=None):
+        """
+        Insert or replace the vector stored for a track
+
+        Parameters:
+        -----------
+        track_id : str
+            Stable track identifier
+        vector : numpy.ndarray
+            Feature vector from build_feature_vector
+        name : str, optional
+            Human-readable track name stored in the id table
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+
+        with self._lock, self._store_lock(exclusive=True):
+            self._sync()
+            row = self._rows.get(track_id)
+            is_new = row is None
+            if is_new:
+                row = len(self._ids)
+                self._ensure_capacity(row + 1)
+
+            self._vectors[row] = vector
+
+            if self._centroids is not None:
+                list_id = int(np.argmax(self._centroids @ vector))
+                if not is_new and self._assignments[row] != list_id:
+                    self._lists[self._assignments[row]].remove(row)
+                    self._lists[list_id].append(row)
+                elif is_new:
+                    self._lists[list_id].append(row)
+                self._assignments[row] = list_id
+            else:
+                self._assignments[row] = -1
+
+            self._vectors.flush()
+            self._assignments.flush()
+
+            if is_new:
+                # The id table is appended last so a crash never exposes a row
+                # whose vector was not written
+                with open(self._ids_path, 'a') as f:
+                    f.write(json.dumps({'id': track_id, 'name': name}) + '\n')
+                self._read_ids()
+
+                if self._centroids is None and len(self._ids) >= EXACT_SEARCH_LIMIT:
+                    self._train()
+
+    def train(self, nlist=None):
+        """
+        (Re)train the coarse quantizer over all stored vectors
+        """
+        with self._lock, self._store_lock(exclusive=True):
+            self._sync()
+            self._train(nlist)
+
+    def _train(self, nlist=None):
+        count = len(self._ids)
+        if nlist is None:
+            nlist = int(4 * np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, size=min(count, KMEANS_MAX_SAMPLE), replace=False))
+        sample = np.asarray(self._vectors[sample_rows])
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            # Keep the previous centroid for lists that lost all their members
+            empty = ~np.any(sums, axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _unit(sums).astype(np.float32)
+
+        for start in range(0, count, SCAN_CHUNK_ROWS):
+            end = min(start + SCAN_CHUNK_ROWS, count)
+            self._assignments[start:end] = np.argmax(self._vectors[start:end] @ centroids.T, axis=1)
+        self._assignments.flush()
+
+        self._centroids = centroids
+        np.save(self._centroids_path, centroids)
+        stat = os.stat(self._centroids_path)
+        self._centroids_version = (stat.st_mtime_ns, stat.st_size)
+        self._rebuild_lists()
+
+    def query(self, vector, k=10, exclude=None):
+        """
+        Find the stored tracks most similar to a feature vector
+
+        Parameters:
+        -----------
+        vector : numpy.ndarray
+            Feature vector from build_feature_vector
+        k : int
+            Number of neighbours to return
+        exclude : str, optional
+            Track id to leave out of the results
+
+        Returns:
+        --------
+        list
+            List of dicts with track_id, name and cosine similarity score
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        if k <= 0:
+            return []
+        wanted = k + (1 if exclude is not None else 0)
+
+        with self._lock, self._store_lock(exclusive=False):
+            self._sync()
+            count = len(self._ids)
+            if count == 0:
+                return []
+
+            if self._centroids is None:
+                rows, scores = self._exact_scan(vector, count, wanted)
+            else:
+                probe = _top_k(self._centroids @ vector, min(self.nprobe, len(self._centroids)))
+                rows = np.concatenate([np.empty(0, dtype=np.int32)] +
+                                      [np.frombuffer(self._lists[list_id], dtype=np.int32)
+                                       for list_id in probe if len(self._lists[list_id])])
+                scores = self._vectors[rows] @ vector
+                best = _top_k(scores, wanted)
+                rows, scores = rows[best], scores[best]
+
+            results = []
+            for row, score in zip(rows, scores):
+                if self._ids[row] == exclude:
+                    continue
+                results.append({
+                    'track_id': self._ids[row],
+                    'name': self._names[row],
+                    'score': float(score)
+                })
+            return results[:k]
+
+    def _exact_scan(self, vector, count, k):
+        """
+        Brute-force scan of the first count rows in cache-sized chunks
+        """
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, count, SCAN_CHUNK_ROWS):
+            end = min(start + SCAN_CHUNK_ROWS, count)
+            scores = np.concatenate([best_scores, self._vectors[start:end] @ vector])
+            rows = np.concatenate([best_rows, np.arange(start, end)])
+            best = _top_k(scores, k)
+            best_rows, best_scores = rows[best], scores[best]
+        return best_rows, best_scores
+
+    def query_track(self, track_id, k=10):
+        """
+        Find the tracks most similar to an already indexed track
+
+        Returns None if the track is not in the index
+        """
+        with self._lock, self._store_lock(exclusive=False):
+            self._sync()
+            row = self._rows.get(track_id)
+            if row is None:
+                return None
+            vector = np.array(self._vectors[row])
+        return self.query(vector, k=k, exclude=track_id)
@@ -1,21 +1,163 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
 import json
+import math
+import hashlib
+import tempfile
+import uuid
+from contextlib import ExitStack
 import numpy as np
 import librosa
-from api.music_analysis import analyze_music_emotion
-from api.brain_mapping import map_emotion_to_brain
-from api.mri_processing import get_mri_slices, overlay_activation
+from api.music_analysis import decode_audio, analyze_audio, create_time_segments
+from api.brain_mapping import (map_emotion_to_brain, generate_time_series, generate_voxel_activations,
+                               build_activation_level, build_activation_pyramid, sparse_voxels, sphere_radii, BRAIN_REGION_COORDINATES,
+                               PYRAMID_LEVELS, DEFAULT_GRID_SIZE)
+from api.mri_processing import get_mri_slices, overlay_activation, render_overlays
+from api.similarity_index import TrackIndex, build_feature_vector
+from api.admission import AdmissionController, AdmissionRejected
+from api.segment_index import (SegmentFeatureIndex, segment_index_path, evict_segment_indexes,
+                               MIN_WINDOW_SECONDS, MAX_SEGMENT_INDEXES)
+from api.overlay_cache import OverlayCache, DEFAULT_QUANTIZATION_STEP
+from api.cancellation import CancellationToken, CancellationRegistry, AnalysisCancelled
 
 app = Flask(__name__)
 CORS(app)
 
+# Admission control for the CPU-heavy analysis pipeline
+# Per-stage caps let decoding, feature extraction and rendering of different
+# requests overlap without all of them hitting the same stage at once
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get('AUDIOGRAM_MAX_CONCURRENT_ANALYSES', 4)),
+    max_queue=int(os.environ.get('AUDIOGRAM_MAX_QUEUED_ANALYSES', 8)),
+    queue_timeout=float(os.environ.get('AUDIOGRAM_QUEUE_TIMEOUT', 10.0)),
+    stage_limits={
+        'decode': int(os.environ.get('AUDIOGRAM_DECODE_CONCURRENCY', 2)),
+        'features': int(os.environ.get('AUDIOGRAM_FEATURES_CONCURRENCY', 2)),
+        'render': int(os.environ.get('AUDIOGRAM_RENDER_CONCURRENCY', 2))
+    }
+)
+
+# Longest time in seconds an analysis may take, including time spent queued
+# Clients can ask for a shorter deadline with the X-Request-Timeout header
+ANALYSIS_DEADLINE = float(os.environ.get('AUDIOGRAM_ANALYSIS_DEADLINE', 120.0))
+
+# In-flight analyses, so clients can cancel requests they abandoned
+cancellations = CancellationRegistry()
+
+# Cache of rendered overlays keyed by quantized region activations
+overlay_cache = OverlayCache(
+    step=float(os.environ.get('AUDIOGRAM_OVERLAY_CACHE_STEP', DEFAULT_QUANTIZATION_STEP)),
+    max_entries=int(os.environ.get('AUDIOGRAM_OVERLAY_CACHE_SIZE', 32))
+)
+
+# Number of per-track segment indexes kept on disk for /api/segments
+SEGMENT_INDEX_LIMIT = int(os.environ.get('AUDIOGRAM_SEGMENT_INDEX_LIMIT', MAX_SEGMENT_INDEXES))
+
+# Persistent index of analyzed tracks for similarity lookups
+similarity_index = TrackIndex()
+
+# Largest number of neighbours returned by /api/similar
+MAX_SIMILAR_RESULTS = 100
+
+def compute_track_id(path):
+    """
+    Compute a stable track identifier from the audio file contents
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_seconds(params, name, default=None):
+    """
+    Read an optional time in seconds from request parameters, rejecting NaN and infinity
+    """
+    value = params.get(name, default)
+    if value is None:
+        return None
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number of seconds")
+    return value
+
+def parse_segment_params(params):
+    """
+    Read the segment_duration and hop timeline parameters from a request
+    """
+    segment_duration = parse_seconds(params, 'segment_duration', 3.0)
+    hop = parse_seconds(params, 'hop')
+    
+    if segment_duration < MIN_WINDOW_SECONDS or (hop is not None and hop < MIN_WINDOW_SECONDS):
+        raise ValueError(f"segment_duration and hop must be at least {MIN_WINDOW_SECONDS} s")
+    return segment_duration, hop
+
+def parse_region_activations(regions):
+    """
+    Validate region activations sent by a client
+    """
+    if not isinstance(regions, dict) or not regions:
+        raise ValueError('regions must be an object of region activations')
+    
+    parsed = {}
+    for region_name, activation in regions.items():
+        if region_name not in BRAIN_REGION_COORDINATES:
+            raise ValueError(f"Unknown region: {region_name}")
+        if isinstance(activation, bool) or not isinstance(activation, (int, float)) or not 0 <= activation <= 1:
+            raise ValueError(f"Activation for {region_name} must be between 0 and 1")
+        parsed[region_name] = float(activation)
+    return parsed
+
+def parse_request_timeout(headers):
+    """
+    Get the deadline of a request, which clients can shorten with X-Request-Timeout
+    """
+    timeout = ANALYSIS_DEADLINE
+    if headers.get('X-Request-Timeout'):
+        timeout = min(timeout, float(headers['X-Request-Timeout']))
+    return timeout
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
     """
     Analyze uploaded music file and return emotion data with brain activation patterns
     """
+    # Clients that set X-Request-Id can cancel the request while it runs
+    request_id = request.headers.get('X-Request-Id') or uuid.uuid4().hex
+    
+    try:
+        timeout = parse_request_timeout(request.headers)
+    except ValueError:
+        return jsonify({'error': 'Invalid X-Request-Timeout header'}), 400
+    
+    cancel_token = CancellationToken(timeout)
+    try:
+        cancellations.register(request_id, cancel_token)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    # Admit before touching the upload so overloaded requests are turned
+    # away without reading the request body
+    try:
+        with admission.admit(cancel_token=cancel_token):
+            return run_analysis(request_id, cancel_token)
+    except AdmissionRejected as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except AnalysisCancelled as e:
+        cancellations.record(e.reason)
+        status = 504 if e.reason == 'deadline' else 499
+        return jsonify({'error': str(e), 'request_id': request_id}), status
+    finally:
+        cancellations.unregister(request_id)
+
+def run_analysis(request_id, cancel_token):
+    """
+    Run the analysis pipeline for the uploaded file of the current request
+    
+    Raises AnalysisCancelled if cancel_token is cancelled or expires; the
+    pipeline checks it between segments and between slice renders.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -23,41 +165,273 @@ def analyze():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
-    # Save the uploaded file temporarily
-    temp_path = os.path.join('temp', file.filename)
+    try:
+        segment_duration, hop = parse_segment_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Save the uploaded file temporarily under a unique name
     os.makedirs('temp', exist_ok=True)
-    file.save(temp_path)
+    fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1].lower(), dir='temp')
+    os.close(fd)
     
     try:
-        # Analyze music to extract emotions
-        emotions = analyze_music_emotion(temp_path)
+        cancel_token.check()
+        file.save(temp_path)
+        track_id = compute_track_id(temp_path)
         
-        # Map emotions to brain activation patterns
-        activation_patterns = map_emotion_to_brain(emotions)
+        # Decode audio
+        with admission.stage('decode', cancel_token):
+            cancel_token.check()
+            y, audio_info = decode_audio(temp_path)
+            sr = audio_info['sr']
+        
+        with admission.stage('features', cancel_token):
+            cancel_token.check()
+            
+            # Index frame-level features once so other timelines can be
+            # requested later without decoding the track again
+            segment_index = SegmentFeatureIndex.from_audio(y, sr, cancel_token=cancel_token)
+            segment_index.save(segment_index_path(track_id))
+            evict_segment_indexes(SEGMENT_INDEX_LIMIT)
+            
+            # Analyze music to extract emotions
+            emotions = analyze_audio(y, sr, segment_duration, hop, segment_index=segment_index,
+                                     cancel_token=cancel_token)
+            emotions['audio'] = audio_info
+            
+            # Map emotions to brain activation patterns
+            # Voxels are only generated if the overlays are not cached
+            activation_patterns = map_emotion_to_brain(emotions, include_voxels=False,
+                                                       cancel_token=cancel_token)
+        
+        # Remember this track's features for similarity lookups
+        similarity_index.add(track_id,
+                             build_feature_vector(emotions, activation_patterns['regions']),
+                             name=file.filename)
         
         # Get MRI slices with activation overlays for all view types
         view_types = ['axial', 'coronal', 'sagittal']
         brain_views = {}
         
-        for view_type in view_types:
-            mri_data = get_mri_slices(slice_type=view_type, num_slices=50)
-            overlay_data = overlay_activation(mri_data, activation_patterns)
-            brain_views[view_type] = overlay_data
-        
-        # Clean up temp file
-        os.remove(temp_path)
+        with admission.stage('render', cancel_token):
+            cancel_token.check()
+            mri_views = {view_type: get_mri_slices(slice_type=view_type, num_slices=50,
+                                                   cancel_token=cancel_token)
+                         for view_type in view_types}
+            
+            # Overlays are rendered from the quantized activations, with the
+            # sphere radii of the exact ones, so that a cached set is exactly
+            # what its key describes
+            quantized_regions = overlay_cache.quantize(activation_patterns['regions'])
+            radii = sphere_radii(activation_patterns['regions'])
+            cache_key = overlay_cache.key(quantized_regions, view_types=view_types, num_slices=50,
+                                          radii=radii)
+            overlays = overlay_cache.get(cache_key)
+            if overlays is None:
+                voxel_data = generate_voxel_activations(quantized_regions, radii=radii,
+                                                        cancel_token=cancel_token)
+                overlays = {view_type: render_overlays(mri_views[view_type], voxel_data, cancel_token)
+                            for view_type in view_types}
+                overlay_cache.put(cache_key, overlays)
+            
+            for view_type in view_types:
+                brain_views[view_type] = overlay_activation(mri_views[view_type], activation_patterns,
+                                                            overlays=overlays[view_type])
         
         return jsonify({
+            'request_id': request_id,
+            'track_id': track_id,
             'emotions': emotions,
+            'activation': {
+                'regions': activation_patterns['regions']
+            },
             'brain_data': brain_views[view_types[0]],  # For backward compatibility
             'brain_views': brain_views
         })
     
+    except AnalysisCancelled:
+        raise
+    
     except Exception as e:
-        # Clean up temp file in case of error
+        return jsonify({'error': str(e)}), 500
+    
+    finally:
+        # Clean up temp file
         if os.path.exists(temp_path):
             os.remove(temp_path)
+
+@app.route('/api/analyze/<request_id>', methods=['DELETE'])
+def cancel_analysis(request_id):
+    """
+    Cancel an in-flight analysis started with the given X-Request-Id
+    """
+    if not cancellations.cancel(request_id):
+        return jsonify({'error': f"No running analysis: {request_id}"}), 404
+    return jsonify({'request_id': request_id, 'cancelled': True})
+
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    """
+    Get load statistics for the analysis pipeline
+    """
+    return jsonify({
+        'admission': admission.stats(),
+        'overlay_cache': overlay_cache.stats(),
+        'cancellation': cancellations.stats()
+    })
+
+@app.route('/api/similar', methods=['GET'])
+def get_similar_tracks():
+    """
+    Get previously analyzed tracks with similar features and brain activation
+    """
+    try:
+        track_id = request.args.get('track_id', None)
+        if not track_id:
+            return jsonify({'error': 'No track_id provided'}), 400
+        try:
+            k = int(request.args.get('k', 10))
+        except ValueError:
+            return jsonify({'error': 'k must be an integer'}), 400
+        k = min(max(k, 1), MAX_SIMILAR_RESULTS)
+        
+        similar = similarity_index.query_track(track_id, k=k)
+        if similar is None:
+            return jsonify({'error': f"Unknown track: {track_id}"}), 404
+        
+        return jsonify({
+            'track_id': track_id,
+            'similar': similar
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/segments', methods=['GET'])
+def get_segments():
+    """
+    Get an emotion and brain activation timeline for an analyzed track
+    
+    Accepts segment_duration and hop (overlapping windows when hop is shorter)
+    and an optional start/end time range, all in seconds.
+    """
+    try:
+        track_id = request.args.get('track_id', None)
+        if not track_id:
+            return jsonify({'error': 'No track_id provided'}), 400
+        
+        try:
+            segment_duration, hop = parse_segment_params(request.args)
+            start_time = parse_seconds(request.args, 'start', 0.0)
+            end_time = parse_seconds(request.args, 'end')
+            index_path = segment_index_path(track_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Indexes of tracks that were not requested for a while are evicted
+        try:
+            segment_index = SegmentFeatureIndex.load(index_path)
+        except FileNotFoundError:
+            return jsonify({'error': f"Unknown track: {track_id}"}), 404
+        
+        segments = create_time_segments(None, segment_index.sr, segment_duration, hop,
+                                        segment_index=segment_index,
+                                        start_time=start_time, end_time=end_time)
+        
+        return jsonify({
+            'track_id': track_id,
+            'segments': segments,
+            'time_series': generate_time_series(segments)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/activation', methods=['POST'])
+def get_activation_volume():
+    """
+    Get the voxel activation volume at a requested level of detail
+    
+    Expects a JSON body with the 'regions' activations returned by
+    /api/analyze, a level of detail 'lod' (grid size, one of PYRAMID_LEVELS)
+    and an optional 'progressive' flag. In progressive mode every level up to
+    lod is streamed as one JSON line, coarsest first; each level is the same
+    as when it is requested on its own, and is only built once the previous
+    one has been handed to the client.
+    
+    Runs under the same admission control, render stage cap, deadline and
+    X-Request-Id cancellation as /api/analyze. The admission slot is held
+    until the last level has been sent, but the render stage only while a
+    level is being built, so a slow reader does not hold up other renders.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        regions = parse_region_activations(body.get('regions'))
+        lod = int(body.get('lod', DEFAULT_GRID_SIZE))
+        if lod not in PYRAMID_LEVELS:
+            raise ValueError(f"lod must be one of {PYRAMID_LEVELS}")
+        timeout = parse_request_timeout(request.headers)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    request_id = request.headers.get('X-Request-Id') or uuid.uuid4().hex
+    cancel_token = CancellationToken(timeout)
+    try:
+        cancellations.register(request_id, cancel_token)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    # Everything held by the request, released in reverse order
+    slots = ExitStack()
+    slots.callback(cancellations.unregister, request_id)
+    try:
+        slots.enter_context(admission.admit(cancel_token=cancel_token))
+        
+        if not body.get('progressive', False):
+            with slots, admission.stage('render', cancel_token):
+                voxel_data = sparse_voxels(build_activation_level(regions, lod, cancel_token))
+            voxel_data['level'] = lod
+            return jsonify(voxel_data)
+        
+        # The coarsest level is built before the response starts, so that
+        # queueing and deadlines are still reported with a status code
+        pyramid = build_activation_pyramid(regions, grid_size=lod, cancel_token=cancel_token)
+        with admission.stage('render', cancel_token):
+            first_level = next(pyramid)
+    except AdmissionRejected as e:
+        slots.close()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except AnalysisCancelled as e:
+        slots.close()
+        cancellations.record(e.reason)
+        status = 504 if e.reason == 'deadline' else 499
+        return jsonify({'error': str(e), 'request_id': request_id}), status
+    except Exception as e:
+        slots.close()
         return jsonify({'error': str(e)}), 500
+    
+    def stream_levels():
+        with slots:
+            level, grid = first_level
+            try:
+                while True:
+                    voxel_data = sparse_voxels(grid)
+                    voxel_data['level'] = level
+                    yield json.dumps(voxel_data) + '\n'
+                    
+                    # Build the next level once the client has taken this one
+                    with admission.stage('render', cancel_token):
+                        next_level = next(pyramid, None)
+                    if next_level is None:
+                        return
+                    level, grid = next_level
+            except AnalysisCancelled as e:
+                # A cancelled stream simply ends early
+                cancellations.record(e.reason)
+    
+    response = Response(stream_levels(), mimetype='application/x-ndjson')
+    # Release the slots even if the stream is never read
+    response.call_on_close(slots.close)
+    return response
 
 @app.route('/api/mri/slices', methods=['GET'])
 def get_slices():
@@ -0,0 +1,522 @@
+"""
+The analysis pipeline as it was before the precision and caching work
+
+Copied from the baseline modules so that benchmarks can measure the old
+code path itself rather than a reimplementation of it. The MRI path is
+passed in instead of being downloaded, and tempo is taken as a scalar
+since newer librosa versions return it as an array. Do not use outside
+benchmarks.
+"""
+import os
+import json
+import base64
+from io import BytesIO
+import numpy as np
+import librosa
+import nibabel as nib
+import matplotlib.pyplot as plt
+from api.brain_mapping import (EMOTION_BRAIN_MAPPING, BRAIN_REGION_COORDINATES, generate_time_series,
+                               get_emotion_colors)
+
+def analyze_music_emotion(audio_path):
+    """
+    Analyze music file and extract emotional characteristics
+    
+    Parameters:
+    -----------
+    audio_path : str
+        Path to the audio file
+        
+    Returns:
+    --------
+    dict
+        Dictionary containing emotion scores and musical features
+    """
+    # Load audio file
+    y, sr = librosa.load(audio_path, sr=22050)
+    
+    # Extract musical features
+    # Tempo (BPM)
+    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    tempo = np.atleast_1d(tempo)[0]
+    
+    # Spectral features
+    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr).mean()
+    spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr).mean()
+    
+    # Harmonic features
+    harmonic = librosa.effects.harmonic(y)
+    chroma = librosa.feature.chroma_cqt(y=harmonic, sr=sr).mean(axis=1)
+    
+    # MFCC features
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+    mfcc_mean = mfcc.mean(axis=1)
+    
+    # Energy
+    energy = np.sum(y**2) / len(y)
+    
+    # Estimate key and mode (major/minor)
+    key = np.argmax(chroma)
+    mode_feature = estimate_mode(y, sr)
+    mode = "major" if mode_feature > 0.5 else "minor"
+    
+    # Map features to emotion scores
+    emotion_scores = calculate_emotion_scores(tempo, mode, energy, spectral_centroid)
+    
+    # Create segments for time-based emotion analysis
+    segments = create_time_segments(y, sr)
+    
+    return {
+        'overall_emotions': emotion_scores,
+        'segments': segments,
+        'features': {
+            'tempo': float(tempo),
+            'mode': mode,
+            'energy': float(energy),
+            'spectral_centroid': float(spectral_centroid),
+            'key': int(key)
+        }
+    }
+
+def estimate_mode(y, sr):
+    """
+    Estimate if the music is in major or minor mode
+    Returns value between 0 (minor) and 1 (major)
+    """
+    # This is a simplified approach - in a real application, 
+    # we would use more sophisticated harmonic analysis
+    harmonic = librosa.effects.harmonic(y)
+    chroma = librosa.feature.chroma_cqt(y=harmonic, sr=sr)
+    
+    # Major and minor chord templates
+    major_template = np.array([1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0])
+    minor_template = np.array([1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0])
+    
+    # Rotate and correlate with templates
+    major_corr = []
+    minor_corr = []
+    
+    for i in range(12):
+        rolled_chroma = np.roll(chroma.mean(axis=1), i)
+        major_corr.append(np.corrcoef(rolled_chroma, major_template)[0, 1])
+        minor_corr.append(np.corrcoef(rolled_chroma, minor_template)[0, 1])
+    
+    # Compare best major correlation with best minor correlation
+    max_major_corr = max(major_corr)
+    max_minor_corr = max(minor_corr)
+    
+    # Return value between 0 (minor) and 1 (major)
+    if max_major_corr + max_minor_corr == 0:
+        return 0.5  # Neutral if no correlation
+    
+    return max_major_corr / (max_major_corr + max_minor_corr)
+
+def calculate_emotion_scores(tempo, mode, energy, spectral_centroid):
+    """
+    Calculate emotion scores based on extracted features
+    """
+    # Normalize features
+    tempo_norm = min(tempo / 180.0, 1.0)  # Normalize tempo with 180 BPM as upper bound
+    energy_norm = min(energy * 100, 1.0)  # Simple energy normalization
+    brightness = min(spectral_centroid / 2000.0, 1.0)  # Spectral centroid normalization
+    
+    # Mode is already binary (major=1, minor=0)
+    mode_value = 1.0 if mode == "major" else 0.0
+    
+    # Calculate emotion scores
+    # These formulas are simplified and would be refined with actual music psychology research
+    happy_score = 0.4 * tempo_norm + 0.3 * mode_value + 0.3 * energy_norm
+    sad_score = 0.3 * (1 - tempo_norm) + 0.4 * (1 - mode_value) + 0.3 * (1 - energy_norm)
+    calm_score = 0.4 * (1 - tempo_norm) + 0.2 * mode_value + 0.4 * (1 - energy_norm)
+    energetic_score = 0.5 * tempo_norm + 0.1 * mode_value + 0.4 * energy_norm
+    tense_score = 0.2 * tempo_norm + 0.5 * (1 - mode_value) + 0.3 * brightness
+    
+    # Normalize scores to sum to 1
+    total = happy_score + sad_score + calm_score + energetic_score + tense_score
+    
+    return {
+        'happy': float(happy_score / total),
+        'sad': float(sad_score / total),
+        'calm': float(calm_score / total),
+        'energetic': float(energetic_score / total),
+        'tense': float(tense_score / total)
+    }
+
+def create_time_segments(y, sr, segment_duration=3.0):
+    """
+    Create time-based segments for emotion analysis throughout the song
+    """
+    # Calculate number of segments
+    total_duration = len(y) / sr
+    num_segments = int(total_duration / segment_duration)
+    
+    segments = []
+    
+    for i in range(num_segments):
+        start_sample = int(i * segment_duration * sr)
+        end_sample = int((i + 1) * segment_duration * sr)
+        
+        # Get segment audio
+        segment_y = y[start_sample:end_sample]
+        
+        # Extract features for this segment
+        tempo, _ = librosa.beat.beat_track(y=segment_y, sr=sr)
+        tempo = np.atleast_1d(tempo)[0]
+        energy = np.sum(segment_y**2) / len(segment_y)
+        spectral_centroid = librosa.feature.spectral_centroid(y=segment_y, sr=sr).mean()
+        
+        # Estimate mode for segment
+        mode_feature = estimate_mode(segment_y, sr)
+        mode = "major" if mode_feature > 0.5 else "minor"
+        
+        # Calculate emotion scores for segment
+        emotion_scores = calculate_emotion_scores(tempo, mode, energy, spectral_centroid)
+        
+        segments.append({
+            'start_time': i * segment_duration,
+            'end_time': (i + 1) * segment_duration,
+            'emotions': emotion_scores
+        })
+    
+    return segments
+
+def map_emotion_to_brain(emotion_data):
+    """
+    Map emotion scores to brain activation patterns
+    
+    Parameters:
+    -----------
+    emotion_data : dict
+        Dictionary containing emotion scores
+        
+    Returns:
+    --------
+    dict
+        Dictionary containing brain activation patterns
+    """
+    # Get overall emotion scores
+    emotion_scores = emotion_data['overall_emotions']
+    
+    # Initialize activation map
+    activation_map = {
+        'regions': {},
+        'voxel_data': {},
+        'time_series': []
+    }
+    
+    # Calculate region activations based on emotion scores
+    for region_name in BRAIN_REGION_COORDINATES.keys():
+        activation_map['regions'][region_name] = 0
+    
+    # For each emotion, add its contribution to region activations
+    for emotion, score in emotion_scores.items():
+        if emotion in EMOTION_BRAIN_MAPPING:
+            emotion_regions = EMOTION_BRAIN_MAPPING[emotion]['regions']
+            for region in emotion_regions:
+                region_name = region['name']
+                intensity = region['intensity']
+                # Add weighted contribution to region activation
+                activation_map['regions'][region_name] += score * intensity
+    
+    # Normalize region activations to 0-1 range
+    max_activation = max(activation_map['regions'].values())
+    if max_activation > 0:
+        for region in activation_map['regions']:
+            activation_map['regions'][region] /= max_activation
+    
+    # Generate voxel-based activation data for visualization
+    activation_map['voxel_data'] = generate_voxel_activations(activation_map['regions'])
+    
+    # Generate time series data from segments
+    if 'segments' in emotion_data:
+        activation_map['time_series'] = generate_time_series(emotion_data['segments'])
+    
+    return activation_map
+
+def generate_voxel_activations(region_activations, grid_size=100):
+    """
+    Generate voxel-based activation data for visualization
+    
+    This creates a simplified 3D grid of activation values
+    In a real application, this would map to actual MRI voxel coordinates
+    """
+    # Create empty 3D grid
+    grid = np.zeros((grid_size, grid_size, grid_size))
+    
+    # For each active region, add activation to corresponding voxels
+    for region_name, activation in region_activations.items():
+        if activation > 0.1:  # Only include regions with significant activation
+            coords = BRAIN_REGION_COORDINATES[region_name]
+            
+            # For each coordinate in the region
+            for x in coords['x']:
+                for y in coords['y']:
+                    for z in coords['z']:
+                        # Convert from anatomical coordinates to grid indices
+                        grid_x = int((x + 50) * grid_size / 100)
+                        grid_y = int((y + 50) * grid_size / 100)
+                        grid_z = int((z + 50) * grid_size / 100)
+                        
+                        # Ensure coordinates are within grid bounds
+                        if 0 <= grid_x < grid_size and 0 <= grid_y < grid_size and 0 <= grid_z < grid_size:
+                            # Create a small sphere of activation around the coordinate
+                            radius = int(5 * activation)
+                            for dx in range(-radius, radius+1):
+                                for dy in range(-radius, radius+1):
+                                    for dz in range(-radius, radius+1):
+                                        # Calculate distance from center
+                                        distance = np.sqrt(dx**2 + dy**2 + dz**2)
+                                        if distance <= radius:
+                                            # Calculate activation based on distance from center
+                                            voxel_activation = activation * (1 - distance/radius)
+                                            
+                                            # Set voxel activation (with bounds checking)
+                                            vx, vy, vz = grid_x+dx, grid_y+dy, grid_z+dz
+                                            if 0 <= vx < grid_size and 0 <= vy < grid_size and 0 <= vz < grid_size:
+                                                # Use maximum if multiple regions overlap
+                                                grid[vx, vy, vz] = max(grid[vx, vy, vz], voxel_activation)
+    
+    # Convert to list format for JSON serialization
+    # We'll use a sparse representation to reduce data size
+    voxel_list = []
+    for x in range(grid_size):
+        for y in range(grid_size):
+            for z in range(grid_size):
+                if grid[x, y, z] > 0.1:  # Only include voxels with significant activation
+                    voxel_list.append({
+                        'x': x,
+                        'y': y,
+                        'z': z,
+                        'value': float(grid[x, y, z])
+                    })
+    
+    return {
+        'dimensions': [grid_size, grid_size, grid_size],
+        'voxels': voxel_list
+    }
+
+def get_mri_slices(mri_path, slice_type='axial', num_slices=10):
+    """
+    Get MRI slices for visualization
+    
+    Parameters:
+    -----------
+    mri_path : str
+        Path to the MRI volume
+    slice_type : str
+        Type of slice ('axial', 'coronal', or 'sagittal')
+    num_slices : int
+        Number of slices to return
+        
+    Returns:
+    --------
+    dict
+        Dictionary containing MRI slice data
+    """
+    # Load MRI data
+    mri_img = nib.load(mri_path)
+    mri_data = mri_img.get_fdata()
+    
+    # Get dimensions
+    nx, ny, nz = mri_data.shape
+    
+    # Determine slice indices based on slice type
+    if slice_type == 'axial':
+        # Axial slices (top to bottom)
+        slice_indices = np.linspace(0.3 * nz, 0.8 * nz, num_slices).astype(int)
+        slices = [mri_data[:, :, i] for i in slice_indices]
+        orientation = 'axial'
+    elif slice_type == 'coronal':
+        # Coronal slices (front to back)
+        slice_indices = np.linspace(0.2 * ny, 0.8 * ny, num_slices).astype(int)
+        slices = [mri_data[:, i, :] for i in slice_indices]
+        orientation = 'coronal'
+    elif slice_type == 'sagittal':
+        # Sagittal slices (left to right)
+        slice_indices = np.linspace(0.3 * nx, 0.7 * nx, num_slices).astype(int)
+        slices = [mri_data[i, :, :] for i in slice_indices]
+        orientation = 'sagittal'
+    else:
+        raise ValueError(f"Invalid slice type: {slice_type}")
+    
+    # Convert slices to base64 encoded PNGs for web display
+    slice_images = []
+    for i, slice_data in enumerate(slices):
+        # Normalize slice data to 0-255 range
+        normalized_slice = ((slice_data - slice_data.min()) / 
+                           (slice_data.max() - slice_data.min()) * 255).astype(np.uint8)
+        
+        # Create matplotlib figure
+        fig, ax = plt.subplots(figsize=(5, 5))
+        ax.imshow(normalized_slice.T, cmap='gray')
+        ax.axis('off')
+        
+        # Save figure to BytesIO object
+        buf = BytesIO()
+        plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0)
+        buf.seek(0)
+        
+        # Encode as base64
+        img_str = base64.b64encode(buf.read()).decode('utf-8')
+        plt.close(fig)
+        
+        slice_images.append({
+            'index': i,
+            'position': int(slice_indices[i]),
+            'image': f"data:image/png;base64,{img_str}"
+        })
+    
+    return {
+        'orientation': orientation,
+        'num_slices': num_slices,
+        'dimensions': [nx, ny, nz],
+        'slices': slice_images
+    }
+
+def overlay_activation(mri_data, activation_map):
+    """
+    Overlay activation patterns on MRI slices
+    
+    Parameters:
+    -----------
+    mri_data : dict
+        Dictionary containing MRI slice data
+    activation_map : dict
+        Dictionary containing activation patterns
+        
+    Returns:
+    --------
+    dict
+        Dictionary containing MRI slices with activation overlays
+    """
+    # Get emotion colors for the overlay
+    emotion_colors = get_emotion_colors()
+    
+    # Create a copy of the MRI data
+    overlay_data = mri_data.copy()
+    
+    # Get voxel data from activation map
+    voxel_data = activation_map['voxel_data']
+    
+    # Create a 3D grid of activation values
+    grid_size = voxel_data['dimensions'][0]
+    activation_grid = np.zeros(voxel_data['dimensions'])
+    
+    for voxel in voxel_data['voxels']:
+        x, y, z = voxel['x'], voxel['y'], voxel['z']
+        activation_grid[x, y, z] = voxel['value']
+    
+    # Get MRI dimensions
+    nx, ny, nz = mri_data['dimensions']
+    
+    # For each slice, create an overlay
+    for slice_info in overlay_data['slices']:
+        slice_index = slice_info['index']
+        slice_position = slice_info['position']
+        
+        # Get the original slice image
+        img_data = slice_info['image']
+        
+        # Create a new overlay based on the orientation
+        if overlay_data['orientation'] == 'axial':
+            # Map activation grid to MRI space
+            z_pos = slice_position
+            z_grid = int((z_pos / nz) * grid_size)
+            
+            # Create overlay
+            overlay = create_overlay(activation_grid[:, :, z_grid], emotion_colors)
+            
+        elif overlay_data['orientation'] == 'coronal':
+            # Map activation grid to MRI space
+            y_pos = slice_position
+            y_grid = int((y_pos / ny) * grid_size)
+            
+            # Create overlay
+            overlay = create_overlay(activation_grid[:, y_grid, :], emotion_colors)
+            
+        elif overlay_data['orientation'] == 'sagittal':
+            # Map activation grid to MRI space
+            x_pos = slice_position
+            x_grid = int((x_pos / nx) * grid_size)
+            
+            # Create overlay
+            overlay = create_overlay(activation_grid[x_grid, :, :], emotion_colors)
+        
+        # Add overlay to slice info
+        slice_info['overlay'] = overlay
+        
+        # Add regions information to the slice
+        # In a real application, this would be based on actual brain atlas data
+        # For now, we'll add a simplified version based on the activation map
+        regions = []
+        for region_name, activation in activation_map['regions'].items():
+            if activation > 0.3:  # Only include regions with significant activation
+                # Get region info from brain_regions.json
+                region_info_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 
+                                              'data', 'brain_regions.json')
+                with open(region_info_path, 'r') as f:
+                    brain_regions = json.load(f)
+                
+                if region_name in brain_regions:
+                    region_info = brain_regions[region_name].copy()
+                    region_info['activation'] = float(activation)
+                    regions.append(region_info)
+        
+        slice_info['regions'] = regions
+    
+    return overlay_data
+
+def create_overlay(activation_slice, emotion_colors):
+    """
+    Create an overlay image for a slice
+    
+    Parameters:
+    -----------
+    activation_slice : numpy.ndarray
+        2D array of activation values
+    emotion_colors : dict
+        Dictionary mapping emotions to colors
+        
+    Returns:
+    --------
+    str
+        Base64 encoded PNG image
+    """
+    # Transpose to match MRI orientation
+    activation_slice = activation_slice.T
+    
+    # Create RGBA array for overlay
+    # Alpha channel will be based on activation value
+    overlay = np.zeros((*activation_slice.shape, 4), dtype=np.uint8)
+    
+    # Set colors based on activation values
+    # This is a simplified approach - in a real application, 
+    # we would use a more sophisticated color mapping
+    
+    # Use a mix of emotion colors weighted by their activation values
+    # For simplicity, we'll use a fixed color scheme here
+    overlay[..., 0] = 255  # Red channel
+    overlay[..., 1] = 0    # Green channel
+    overlay[..., 2] = 255  # Blue channel
+    
+    # Set alpha channel based on activation value
+    # Scale to 0-255 range with a minimum threshold
+    alpha = (activation_slice * 255).astype(np.uint8)
+    alpha[alpha < 50] = 0  # Threshold to remove low activations
+    overlay[..., 3] = alpha
+    
+    # Create matplotlib figure
+    fig, ax = plt.subplots(figsize=(5, 5))
+    ax.imshow(overlay)
+    ax.axis('off')
+    
+    # Save figure to BytesIO object
+    buf = BytesIO()
+    plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0)
+    buf.seek(0)
+    
+    # Encode as base64
+    img_str = base64.b64encode(buf.read()).decode('utf-8')
+    plt.close(fig)
+    
+    return f"data:image/png;base64,{img_str}"
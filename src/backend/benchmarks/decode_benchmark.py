@@ -0,0 +1,68 @@
+"""
+Decode and resample benchmark
+
+Times decode_audio against librosa.load(sr=22050) for each container format
+and source sample rate, and reports which decoder and resampler were used.
+
+Usage (from src/backend):
+    python -m benchmarks.decode_benchmark [--duration 60] [--repeats 3]
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import librosa
+from api.music_analysis import decode_audio, TARGET_SR
+from benchmarks.memory_report import synthesize_track
+
+FORMATS = ['wav', 'flac', 'ogg']
+SOURCE_RATES = [22050, 44100, 48000, 96000]
+
+def best_time(func, repeats):
+    """
+    Run a function repeatedly and return its last result and fastest time in seconds
+    
+    One untimed warm-up run comes first so that imports, filter design and the
+    page cache do not count against whichever path happens to run first.
+    """
+    func()
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=60.0, help='Test track length in seconds')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per measurement (fastest is kept)')
+    args = parser.parse_args()
+
+    print(f"{'format':6s} {'source sr':>9s} {'decoder':>10s} {'resampler':>10s} "
+          f"{'decode':>9s} {'librosa':>9s} {'speedup':>8s} {'max diff':>9s}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in FORMATS:
+            for source_sr in SOURCE_RATES:
+                path = os.path.join(tmp, f"track_{source_sr}.{fmt}")
+                try:
+                    synthesize_track(path, args.duration, sr=source_sr)
+                except Exception as e:
+                    print(f"{fmt:6s} {source_sr:9d} skipped: {e}")
+                    continue
+
+                (y, info), decode_time = best_time(lambda: decode_audio(path), args.repeats)
+                (y_ref, _), librosa_time = best_time(lambda: librosa.load(path, sr=TARGET_SR),
+                                                     args.repeats)
+
+                length = min(len(y), len(y_ref))
+                max_diff = np.abs(y[:length] - y_ref[:length]).max()
+                print(f"{fmt:6s} {source_sr:9d} {info['decoder']:>10s} {info['resampler']:>10s} "
+                      f"{decode_time * 1000:7.1f}ms {librosa_time * 1000:7.1f}ms "
+                      f"{librosa_time / decode_time:7.1f}x {max_diff:9.2e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Per-request memory report for the analysis pipeline
+
+The headline is the peak traced allocation of one whole request (decode,
+feature extraction, brain mapping, activation grids and one rendered view)
+along two code paths: the baseline pipeline from before the precision and
+caching work (benchmarks/baseline_pipeline.py, which loads the MRI volume
+in float64 for every view) and the current one, whose first request also
+loads the shared float32 volume. A per-stage breakdown of the current
+pipeline and the numerical differences of its float32/uint8 policy follow;
+bounds on these are enforced by tests/test_precision.py.
+
+Usage (from src/backend):
+    python -m benchmarks.memory_report [--duration 30] [--num-slices 50]
+"""
+import argparse
+import os
+import tempfile
+import tracemalloc
+import numpy as np
+import librosa
+import nibabel as nib
+import soundfile as sf
+from api import mri_processing
+from api.music_analysis import decode_audio, analyze_audio
+from api.brain_mapping import (map_emotion_to_brain, generate_voxel_activations, build_activation_grid,
+                               sphere_radii)
+from api.mri_processing import (download_sample_mri_data, load_mri_volume, get_mri_slices,
+                                overlay_activation, render_overlays)
+from api.overlay_cache import OverlayCache
+from api.precision import quantize_unit, dequantize_unit
+from api.segment_index import SegmentFeatureIndex
+from benchmarks import baseline_pipeline
+
+MB = 1024 * 1024
+
+# Shape of the MNI template, used for a synthetic volume when it is unavailable
+MNI_SHAPE = (197, 233, 189)
+
+def synthesize_track(path, duration, sr=44100):
+    """
+    Write a stereo test track with a chord progression and percussive clicks
+    """
+    t = np.arange(int(duration * sr)) / sr
+    chords = [(261.63, 329.63, 392.00), (220.00, 261.63, 329.63)]
+    y = np.zeros_like(t)
+    for i, chord in enumerate(chords):
+        mask = (t // 2).astype(int) % len(chords) == i
+        for freq in chord:
+            y[mask] += np.sin(2 * np.pi * freq * t[mask]) / len(chord)
+    y[(t * 2) % 1 < 0.01] += 0.5
+    frames = np.stack([y, 0.8 * y], axis=1) * 0.5
+    # Written in blocks: libsndfile's Vorbis encoder can crash on one large write
+    with sf.SoundFile(path, 'w', samplerate=sr, channels=2) as f:
+        for start in range(0, len(frames), 65536):
+            f.write(frames[start:start + 65536])
+
+def measure(func, *args, **kwargs):
+    """
+    Run a function and return its result with the peak traced allocation in MB
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / MB
+
+def mri_volume_path(tmp):
+    """
+    Get the MNI template, or point both pipelines at a synthetic volume of
+    the same shape if it cannot be downloaded
+    """
+    try:
+        return download_sample_mri_data()
+    except Exception as e:
+        print(f"MNI template unavailable ({e.__class__.__name__}), using a synthetic volume")
+    path = os.path.join(tmp, 'volume.nii.gz')
+    data = np.random.default_rng(0).integers(0, 1000, MNI_SHAPE, dtype=np.int16)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+    mri_processing.download_sample_mri_data = lambda: path
+    load_mri_volume.cache_clear()
+    return path
+
+def baseline_request(path, mri_path, num_slices):
+    """
+    One request through the baseline pipeline, rendering a single view
+    """
+    emotions = baseline_pipeline.analyze_music_emotion(path)
+    activation = baseline_pipeline.map_emotion_to_brain(emotions)
+    mri_data = baseline_pipeline.get_mri_slices(mri_path, slice_type='axial', num_slices=num_slices)
+    return baseline_pipeline.overlay_activation(mri_data, activation)
+
+def current_request(path, num_slices):
+    """
+    One request through the current pipeline, as run_analysis does it
+    with an overlay cache miss, rendering a single view
+    """
+    y, audio_info = decode_audio(path)
+    sr = audio_info['sr']
+    segment_index = SegmentFeatureIndex.from_audio(y, sr)
+    emotions = analyze_audio(y, sr, segment_index=segment_index)
+    activation = map_emotion_to_brain(emotions, include_voxels=False)
+
+    mri_data = get_mri_slices(slice_type='axial', num_slices=num_slices)
+    regions = activation['regions']
+    voxel_data = generate_voxel_activations(OverlayCache(cache_dir=None).quantize(regions),
+                                            radii=sphere_radii(regions))
+    overlays = render_overlays(mri_data, voxel_data)
+    return overlay_activation(mri_data, activation, overlays=overlays)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30.0, help='Test track length in seconds')
+    parser.add_argument('--num-slices', type=int, default=50, help='Slices rendered per view')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'track.wav')
+        synthesize_track(path, args.duration)
+        mri_path = mri_volume_path(tmp)
+
+        _, baseline_peak = measure(baseline_request, path, mri_path, args.num_slices)
+        _, first_peak = measure(current_request, path, args.num_slices)
+        _, steady_peak = measure(current_request, path, args.num_slices)
+
+        # Per-stage breakdown of the current pipeline (the MRI volume is cached)
+        (y, audio_info), decode_peak = measure(decode_audio, path)
+        sr = audio_info['sr']
+        segment_index, index_peak = measure(SegmentFeatureIndex.from_audio, y, sr)
+        emotions, features_peak = measure(analyze_audio, y, sr, segment_index=segment_index)
+        activation, mapping_peak = measure(map_emotion_to_brain, emotions, include_voxels=False)
+        voxel_data, grid_peak = measure(generate_voxel_activations, activation['regions'])
+        mri_data, slices_peak = measure(get_mri_slices, slice_type='axial', num_slices=args.num_slices)
+        _, render_peak = measure(render_overlays, mri_data, voxel_data)
+
+    print(f"Peak traced allocation per request, {args.duration:g} s track, one view of {args.num_slices} slices")
+    print(f"  baseline pipeline                       {baseline_peak:8.1f} MB")
+    print(f"  current pipeline, first request         {first_peak:8.1f} MB  (loads the shared MRI volume)")
+    print(f"  current pipeline, later requests        {steady_peak:8.1f} MB")
+    print()
+
+    stages = [
+        ('decode', decode_peak),
+        ('segment feature index', index_peak),
+        ('feature extraction', features_peak),
+        ('brain mapping', mapping_peak),
+        ('voxel activation grid', grid_peak),
+        ('MRI slices (one view)', slices_peak),
+        ('overlay render (one view)', render_peak),
+    ]
+    print('Peak traced allocation per stage, current pipeline')
+    for name, peak in stages:
+        print(f"  {name:40s}{peak:8.1f} MB")
+    print()
+
+    # Numerical differences introduced by the policy, on the same decoded
+    # signal so resampler differences do not mask precision differences
+    regions = activation['regions']
+    y64 = y.astype(np.float64)
+    energy_32 = float(np.sum(y ** 2, dtype=np.float64) / len(y))
+    energy_64 = float(np.sum(y64 ** 2) / len(y64))
+    centroid_32 = librosa.feature.spectral_centroid(y=y, sr=sr).mean()
+    centroid_64 = librosa.feature.spectral_centroid(y=y64, sr=sr).mean()
+    mfcc_32 = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13).mean(axis=1)
+    mfcc_64 = librosa.feature.mfcc(y=y64, sr=sr, n_mfcc=13).mean(axis=1)
+    grid_error = np.abs(build_activation_grid(regions) -
+                        build_activation_grid(regions, dtype=np.float64)).max()
+    grid = np.random.default_rng(0).random((50, 50, 50), dtype=np.float32)
+    quantization_error = np.abs(dequantize_unit(quantize_unit(grid)) - grid).max()
+
+    print('Numerical differences vs float64')
+    print(f"  energy (relative)               {abs(energy_32 - energy_64) / energy_64:.2e}")
+    print(f"  spectral centroid (relative)    {abs(centroid_32 - centroid_64) / centroid_64:.2e}")
+    print(f"  MFCC means (max abs)            {np.abs(mfcc_32 - mfcc_64).max():.2e}")
+    print(f"  voxel activation grid (max abs) {grid_error:.2e}")
+    print(f"  uint8 activation levels (max)   {quantization_error:.2e} (bound {0.5 / 255:.2e})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Make the backend packages (api, benchmarks) importable when pytest is run
+# from the repository root or from src/backend
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,93 @@
+import threading
+import time
+from contextlib import ExitStack
+import pytest
+from api.admission import AdmissionController, AdmissionRejected
+from api.cancellation import AnalysisCancelled, CancellationToken
+
+def fill(controller, stack):
+    """
+    Take every pipeline slot until the stack is closed
+    """
+    for _ in range(controller.max_concurrent):
+        stack.enter_context(controller.admit())
+
+def test_rejects_when_queue_is_full():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1.0)
+    with ExitStack() as stack:
+        fill(controller, stack)
+        with pytest.raises(AdmissionRejected) as e:
+            with controller.admit():
+                pass
+    assert e.value.reason == 'queue_full'
+    assert controller.stats()['rejected']['queue_full'] == 1
+
+def test_rejects_after_queue_timeout():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+    with ExitStack() as stack:
+        fill(controller, stack)
+        with pytest.raises(AdmissionRejected) as e:
+            with controller.admit():
+                pass
+    assert e.value.reason == 'queue_timeout'
+    assert e.value.retry_after >= 1
+
+def test_admits_when_slot_frees_up():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5.0)
+    stack = ExitStack()
+    fill(controller, stack)
+    threading.Timer(0.05, stack.close).start()
+    with controller.admit():
+        assert controller.stats()['active'] == 1
+    assert controller.stats()['completed'] == 2
+
+def test_cancelled_request_leaves_queue():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=30.0)
+    token = CancellationToken()
+    with ExitStack() as stack:
+        fill(controller, stack)
+        threading.Timer(0.05, token.cancel).start()
+        start = time.monotonic()
+        with pytest.raises(AnalysisCancelled) as e:
+            with controller.admit(cancel_token=token):
+                pass
+        assert time.monotonic() - start < 5.0
+    assert e.value.reason == 'client'
+    stats = controller.stats()
+    assert stats['queue_depth'] == 0
+    assert stats['rejected'] == {'queue_full': 0, 'queue_timeout': 0}
+
+def test_deadline_in_queue_is_a_cancellation():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=30.0)
+    token = CancellationToken(timeout=0.05)
+    with ExitStack() as stack:
+        fill(controller, stack)
+        with pytest.raises(AnalysisCancelled) as e:
+            with controller.admit(cancel_token=token):
+                pass
+    assert e.value.reason == 'deadline'
+    assert controller.stats()['rejected']['queue_timeout'] == 0
+
+def test_cancelled_request_leaves_stage_queue():
+    controller = AdmissionController(stage_limits={'decode': 1})
+    token = CancellationToken()
+    with controller.stage('decode'):
+        threading.Timer(0.05, token.cancel).start()
+        with pytest.raises(AnalysisCancelled):
+            with controller.stage('decode', token):
+                pass
+    assert controller.stats()['stages']['decode'] == {'limit': 1, 'active': 0, 'waiting': 0}
+
+def test_token_callbacks():
+    token = CancellationToken()
+    calls = []
+    token.add_callback(lambda: calls.append('a'))
+    removed = lambda: calls.append('b')
+    token.add_callback(removed)
+    token.remove_callback(removed)
+    token.cancel()
+    token.cancel()
+    # Callbacks added after cancellation run immediately
+    token.add_callback(lambda: calls.append('c'))
+    assert calls == ['a', 'c']
+    assert token.reason == 'client'
@@ -0,0 +1,81 @@
+import io
+import json
+from contextlib import ExitStack
+import pytest
+import app as audiogram
+
+@pytest.fixture
+def client():
+    return audiogram.app.test_client()
+
+def test_deadline_while_queued_returns_504(client):
+    admission = audiogram.admission
+    before = audiogram.cancellations.stats()['cancelled']['deadline']
+    rejected = dict(admission.stats()['rejected'])
+    with ExitStack() as stack:
+        for _ in range(admission.max_concurrent):
+            stack.enter_context(admission.admit())
+        response = client.post('/api/analyze', headers={'X-Request-Timeout': '0.1'})
+
+    assert response.status_code == 504
+    assert audiogram.cancellations.stats()['cancelled']['deadline'] == before + 1
+    assert admission.stats()['rejected'] == rejected
+
+def test_activation_levels_agree(client):
+    regions = {'amygdala': 0.8, 'insula': 0.5, 'hippocampus': 0.3}
+    response = client.post('/api/activation', json={'regions': regions, 'lod': 100, 'progressive': True})
+    assert response.status_code == 200
+    levels = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [level['level'] for level in levels] == [25, 50, 100]
+
+    for level in levels:
+        direct = client.post('/api/activation', json={'regions': regions, 'lod': level['level']})
+        assert direct.get_json() == level
+    assert audiogram.admission.stats()['active'] == 0
+
+def test_activation_stream_builds_levels_on_demand(client, monkeypatch):
+    from api import brain_mapping
+    built = []
+    build_level = brain_mapping.build_activation_level
+    monkeypatch.setattr(brain_mapping, 'build_activation_level',
+                        lambda regions, level, cancel_token=None: built.append(level) or
+                        build_level(regions, level, cancel_token))
+
+    response = client.post('/api/activation', json={'regions': {'amygdala': 0.8}, 'lod': 200,
+                                                    'progressive': True}, buffered=False)
+    lines = response.response
+    assert json.loads(next(lines))['level'] == 25
+    assert built == [25]
+    # A client still reading the stream only holds its admission slot
+    stats = audiogram.admission.stats()
+    assert stats['active'] == 1
+    assert stats['stages']['render']['active'] == 0
+
+    assert [json.loads(line)['level'] for line in lines] == [50, 100, 200]
+    assert built == [25, 50, 100, 200]
+    response.close()
+    assert audiogram.admission.stats()['active'] == 0
+
+def test_activation_deadline_while_queued(client):
+    admission = audiogram.admission
+    with ExitStack() as stack:
+        for _ in range(admission.max_concurrent):
+            stack.enter_context(admission.admit())
+        response = client.post('/api/activation', json={'regions': {'amygdala': 1.0}},
+                               headers={'X-Request-Timeout': '0.1'})
+    assert response.status_code == 504
+    assert audiogram.cancellations.stats()['in_flight'] == 0
+
+def test_activation_rejects_bad_lod(client):
+    response = client.post('/api/activation', json={'regions': {'amygdala': 1.0}, 'lod': 30})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('query', ['segment_duration=nan', 'hop=inf', 'hop=-inf', 'start=nan', 'end=inf'])
+def test_segments_rejects_non_finite_times(client, query):
+    response = client.get(f"/api/segments?track_id={'0' * 40}&{query}")
+    assert response.status_code == 400
+
+def test_analyze_rejects_non_finite_segment_duration(client):
+    data = {'file': (io.BytesIO(b'not audio'), 'track.wav'), 'segment_duration': 'nan'}
+    response = client.post('/api/analyze', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400
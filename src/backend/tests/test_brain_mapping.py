@@ -0,0 +1,77 @@
+import time
+import numpy as np
+import pytest
+from api.brain_mapping import (build_activation_grid, build_activation_level, build_activation_pyramid,
+                               max_pool, sparse_voxels, sphere_radii, BRAIN_REGION_COORDINATES,
+                               PYRAMID_LEVELS, DEFAULT_GRID_SIZE)
+
+REGIONS = {'amygdala': 0.8, 'insula': 0.5, 'hippocampus': 0.3, 'motor_cortex': 0.15}
+
+@pytest.mark.parametrize('lod', PYRAMID_LEVELS)
+def test_pyramid_levels_match_direct_levels(lod):
+    pyramid = list(build_activation_pyramid(REGIONS, lod))
+    assert [level for level, _ in pyramid] == [level for level in PYRAMID_LEVELS if level <= lod]
+    for level, grid in pyramid:
+        assert grid.shape == (level,) * 3
+        np.testing.assert_array_equal(grid, build_activation_level(REGIONS, level))
+
+def test_pyramid_is_built_on_demand(monkeypatch):
+    from api import brain_mapping
+    built = []
+    build_level = brain_mapping.build_activation_level
+    monkeypatch.setattr(brain_mapping, 'build_activation_level',
+                        lambda regions, level, cancel_token=None: built.append(level) or
+                        build_level(regions, level, cancel_token))
+
+    pyramid = build_activation_pyramid(REGIONS, 200)
+    assert built == []
+    assert next(pyramid)[0] == 25
+    assert built == [25]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_coarse_levels_equal_pooled_default_level(seed):
+    rng = np.random.default_rng(seed)
+    regions = {region: float(rng.uniform(0, 1)) for region in BRAIN_REGION_COORDINATES}
+    grid = build_activation_grid(regions)
+    for level in (25, 50):
+        np.testing.assert_array_equal(build_activation_level(regions, level),
+                                      max_pool(grid, DEFAULT_GRID_SIZE // level))
+
+def test_coarse_levels_cost_no_more_than_default_level():
+    regions = {region: 1.0 for region in BRAIN_REGION_COORDINATES}
+    best = {}
+    for _ in range(20):
+        for level in (25, 50, DEFAULT_GRID_SIZE):
+            start = time.perf_counter()
+            build_activation_level(regions, level)
+            elapsed = time.perf_counter() - start
+            best[level] = min(best.get(level, elapsed), elapsed)
+    assert best[25] <= best[DEFAULT_GRID_SIZE]
+    assert best[50] <= best[DEFAULT_GRID_SIZE]
+
+def test_coarse_levels_keep_every_region():
+    fine = sparse_voxels(build_activation_level(REGIONS, DEFAULT_GRID_SIZE))
+    for level in (25, 50):
+        coarse = sparse_voxels(build_activation_level(REGIONS, level))
+        assert len(coarse['voxels']) > 0
+        # Pooling keeps the peak activation of the volume
+        assert max(v['value'] for v in coarse['voxels']) == max(v['value'] for v in fine['voxels'])
+
+def test_default_level_is_the_analysis_grid():
+    np.testing.assert_array_equal(build_activation_level(REGIONS, DEFAULT_GRID_SIZE),
+                                  build_activation_grid(REGIONS))
+
+def test_rejects_unknown_level():
+    with pytest.raises(ValueError):
+        build_activation_level(REGIONS, 30)
+
+def test_max_pool():
+    grid = np.arange(64, dtype=np.float32).reshape(4, 4, 4)
+    pooled = max_pool(grid, 2)
+    assert pooled.shape == (2, 2, 2)
+    assert pooled[0, 0, 0] == grid[:2, :2, :2].max()
+    assert max_pool(np.zeros((4, 6, 2), dtype=np.float32), 2).shape == (2, 3, 1)
+
+def test_sphere_radii_scale_with_grid():
+    assert sphere_radii(REGIONS) == {'amygdala': 4, 'insula': 2, 'hippocampus': 1, 'motor_cortex': 0}
+    assert sphere_radii(REGIONS, 200)['amygdala'] == 8
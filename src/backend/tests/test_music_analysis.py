@@ -0,0 +1,102 @@
+from math import gcd
+import numpy as np
+import pytest
+import soundfile as sf
+from scipy.signal import resample_poly
+from api import music_analysis
+from api.music_analysis import (TARGET_SR, _resample_poly_chunked, analyze_music_emotion,
+                                decode_audio, register_decoder, resample_audio)
+
+def write_tone(path, duration=3.0, sr=44100, channels=2):
+    t = np.arange(int(duration * sr)) / sr
+    y = 0.5 * np.sin(2 * np.pi * 440 * t)
+    sf.write(path, np.stack([y] * channels, axis=1), sr)
+
+@pytest.fixture
+def decoders(monkeypatch):
+    registry = []
+    monkeypatch.setattr(music_analysis, 'AUDIO_DECODERS', registry)
+    return registry
+
+@pytest.mark.parametrize('source_sr', [8000, 11025, 16000, 32000, 44100, 48000, 96000])
+def test_chunked_resample_matches_single_call(source_sr):
+    divisor = gcd(source_sr, TARGET_SR)
+    up, down = TARGET_SR // divisor, source_sr // divisor
+    y = np.random.default_rng(0).standard_normal(3 * source_sr).astype(np.float32)
+
+    chunked = _resample_poly_chunked(y, up, down, chunk_frames=8192)
+    single = resample_poly(y, up, down).astype(np.float32)
+    assert chunked.dtype == np.float32
+    assert np.array_equal(chunked, single)
+
+def test_resampler_selection(monkeypatch):
+    y = np.zeros(44100, dtype=np.float32)
+    assert resample_audio(y, TARGET_SR, TARGET_SR)[1] == 'none'
+    if music_analysis.soxr is not None:
+        assert resample_audio(y, 44100, TARGET_SR)[1] == 'soxr'
+
+    monkeypatch.setattr(music_analysis, 'soxr', None)
+    resampled, resampler = resample_audio(y, 44100, TARGET_SR)
+    assert resampler == 'polyphase'
+    assert len(resampled) == TARGET_SR
+    # 22050/22051 needs a polyphase factor above MAX_POLYPHASE_FACTOR
+    assert resample_audio(y, 22051, TARGET_SR)[1] == 'librosa'
+
+def test_decoders_tried_in_order(decoders, tmp_path):
+    calls = []
+
+    def failing(path):
+        calls.append('failing')
+        raise RuntimeError('unsupported')
+
+    def working(path):
+        calls.append('working')
+        return np.ones(TARGET_SR, dtype=np.float32), TARGET_SR
+
+    def never(path):
+        calls.append('never')
+        return np.zeros(TARGET_SR, dtype=np.float32), TARGET_SR
+
+    register_decoder('mp3only', never, extensions=('.mp3',))
+    register_decoder('failing', failing)
+    register_decoder('working', working)
+    register_decoder('later', never)
+
+    y, info = decode_audio(str(tmp_path / 'track.wav'))
+    assert calls == ['failing', 'working']
+    assert info['decoder'] == 'working'
+    assert np.all(y == 1)
+
+def test_decode_errors_are_collected(decoders, tmp_path):
+    def failing(path):
+        raise RuntimeError('unsupported')
+
+    register_decoder('first', failing)
+    register_decoder('second', failing)
+    with pytest.raises(ValueError, match='first: unsupported; second: unsupported'):
+        decode_audio(str(tmp_path / 'track.wav'))
+
+def test_soundfile_falls_back_to_librosa(tmp_path, monkeypatch):
+    path = str(tmp_path / 'track.wav')
+    write_tone(path)
+
+    def broken(path):
+        raise RuntimeError('libsndfile unavailable')
+
+    soundfile_decoder = next(d for d in music_analysis.AUDIO_DECODERS if d['name'] == 'soundfile')
+    monkeypatch.setitem(soundfile_decoder, 'decode', broken)
+    y, info = decode_audio(path)
+    assert info['decoder'] == 'librosa'
+    assert y.dtype == np.float32
+    assert len(y) == 3 * TARGET_SR
+
+def test_analysis_reports_audio_metadata(tmp_path):
+    path = str(tmp_path / 'track.wav')
+    write_tone(path, duration=4.0, sr=48000)
+
+    audio = analyze_music_emotion(path)['audio']
+    assert audio['decoder'] == 'soundfile'
+    assert audio['resampler'] in ('soxr', 'polyphase')
+    assert audio['source_sr'] == 48000
+    assert audio['sr'] == TARGET_SR
+    assert audio['duration'] == pytest.approx(4.0)
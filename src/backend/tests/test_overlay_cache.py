@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from api.brain_mapping import build_activation_grid, sparse_voxels, sphere_radii, BRAIN_REGION_COORDINATES
+from api.mri_processing import display_grid, OVERLAY_ALPHA_THRESHOLD
+from api.overlay_cache import OverlayCache, DEFAULT_QUANTIZATION_STEP
+from api.precision import DISPLAY_LEVELS
+
+# Largest change in display levels from moving a value by half a step
+MAX_LEVEL_ERROR = int(np.ceil(DISPLAY_LEVELS * DEFAULT_QUANTIZATION_STEP / 2))
+
+def random_regions(rng):
+    """
+    Region activations normalized like map_emotion_to_brain's output
+    """
+    values = rng.random(len(BRAIN_REGION_COORDINATES))
+    return dict(zip(BRAIN_REGION_COORDINATES, (values / values.max()).tolist()))
+
+def visible_alpha(grid):
+    """
+    Overlay alpha levels after the display threshold
+    """
+    levels = display_grid(sparse_voxels(grid)).astype(int)
+    return np.where(levels >= OVERLAY_ALPHA_THRESHOLD, levels, 0)
+
+def test_quantization_error_bound():
+    cache = OverlayCache(cache_dir=None)
+    rng = np.random.default_rng(0)
+    for _ in range(40):
+        regions = random_regions(rng)
+        radii = sphere_radii(regions)
+        exact = build_activation_grid(regions, radii=radii)
+        quantized = build_activation_grid(cache.quantize(regions), radii=radii)
+        assert np.abs(exact - quantized).max() <= DEFAULT_QUANTIZATION_STEP / 2 + 1e-6
+
+        alpha_exact, alpha_quantized = visible_alpha(exact), visible_alpha(quantized)
+        switched = (alpha_exact > 0) != (alpha_quantized > 0)
+        assert np.abs(alpha_exact - alpha_quantized)[~switched].max() <= MAX_LEVEL_ERROR
+        # Voxels only appear or disappear right at the display threshold
+        assert np.all(np.maximum(alpha_exact, alpha_quantized)[switched] <
+                      OVERLAY_ALPHA_THRESHOLD + MAX_LEVEL_ERROR)
+
+def test_key_depends_on_levels_and_variant():
+    cache = OverlayCache(cache_dir=None)
+    regions = {'amygdala': 0.51, 'insula': 0.2}
+    assert cache.key(regions) == cache.key({'insula': 0.21, 'amygdala': 0.5})
+    assert cache.key(regions) != cache.key({'amygdala': 0.6, 'insula': 0.2})
+    assert cache.key(regions, num_slices=50) != cache.key(regions, num_slices=10)
+
+def test_memory_lru_and_disk_hits(tmp_path):
+    cache = OverlayCache(cache_dir=str(tmp_path), max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, [key])
+    assert cache.get('c') == ['c']
+    # 'a' was evicted from memory but is still on disk
+    assert cache.get('a') == ['a']
+    assert cache.get('missing') is None
+    stats = cache.stats()
+    assert (stats['memory_hits'], stats['disk_hits'], stats['misses']) == (1, 1, 1)
+
+def test_disk_eviction(tmp_path):
+    cache = OverlayCache(cache_dir=str(tmp_path), max_entries=1, max_disk_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, [key])
+    assert len(list(tmp_path.iterdir())) == 2
+
+def test_rejects_non_positive_step():
+    with pytest.raises(ValueError):
+        OverlayCache(cache_dir=None, step=0)
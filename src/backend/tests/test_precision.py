@@ -0,0 +1,56 @@
+import numpy as np
+import librosa
+import pytest
+from api.brain_mapping import build_activation_grid, BRAIN_REGION_COORDINATES
+from api.precision import DISPLAY_LEVELS, quantize_unit, dequantize_unit
+
+SR = 22050
+
+@pytest.fixture(scope='module')
+def signal():
+    """
+    Five seconds of a two-note chord with percussive clicks, in float64
+    """
+    t = np.arange(5 * SR) / SR
+    y = 0.3 * (np.sin(2 * np.pi * 261.63 * t) + 0.5 * np.sin(2 * np.pi * 392.00 * t))
+    y[(t * 2) % 1 < 0.01] += 0.5
+    return y
+
+def relative_error(value, reference):
+    return abs(value - reference) / abs(reference)
+
+def test_energy_float32_matches_float64(signal):
+    y32 = signal.astype(np.float32)
+    energy_32 = np.sum(y32 ** 2, dtype=np.float64) / len(y32)
+    energy_64 = np.sum(signal ** 2) / len(signal)
+    assert relative_error(energy_32, energy_64) < 1e-6
+
+def test_spectral_centroid_float32_matches_float64(signal):
+    centroid_32 = librosa.feature.spectral_centroid(y=signal.astype(np.float32), sr=SR).mean()
+    centroid_64 = librosa.feature.spectral_centroid(y=signal, sr=SR).mean()
+    assert relative_error(centroid_32, centroid_64) < 1e-4
+
+def test_mfcc_float32_matches_float64(signal):
+    mfcc_32 = librosa.feature.mfcc(y=signal.astype(np.float32), sr=SR, n_mfcc=13).mean(axis=1)
+    mfcc_64 = librosa.feature.mfcc(y=signal, sr=SR, n_mfcc=13).mean(axis=1)
+    # MFCCs are in dB-scaled units; 0.01 is far below any emotion threshold
+    assert np.abs(mfcc_32 - mfcc_64).max() < 1e-2
+
+def test_quantize_unit_error_is_half_a_level():
+    values = np.random.default_rng(0).random(100000)
+    error = np.abs(dequantize_unit(quantize_unit(values)) - values)
+    assert error.max() <= 0.5 / DISPLAY_LEVELS + 1e-6
+
+def test_quantize_unit_clips_to_unit_range():
+    levels = quantize_unit([-0.5, 0.0, 1.0, 1.5])
+    assert levels.dtype == np.uint8
+    assert levels.tolist() == [0, 0, DISPLAY_LEVELS, DISPLAY_LEVELS]
+
+def test_activation_grid_float32_matches_float64():
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        regions = dict(zip(BRAIN_REGION_COORDINATES, rng.random(len(BRAIN_REGION_COORDINATES)).tolist()))
+        grid_32 = build_activation_grid(regions)
+        grid_64 = build_activation_grid(regions, dtype=np.float64)
+        assert grid_32.dtype == np.float32
+        assert np.abs(grid_32 - grid_64).max() < 1e-6
@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import pytest
+from api.segment_index import SegmentFeatureIndex, evict_segment_indexes, _prefix_sum
+
+SR = 1000
+HOP = 100
+DURATION = 10.0
+
+@pytest.fixture
+def signal():
+    return np.random.default_rng(0).standard_normal(int(SR * DURATION)).astype(np.float32)
+
+@pytest.fixture
+def index(signal):
+    """
+    Index with 10 frames per second, a beat every 0.5 s and known frame features
+    """
+    num_frames = len(signal) // HOP + 1
+    block_energy = np.square(signal.astype(np.float64)).reshape(-1, HOP).sum(axis=1)
+    centroid = np.arange(num_frames, dtype=np.float32)
+    onset = np.ones(num_frames, dtype=np.float32)
+    chroma = np.tile(np.eye(12, dtype=np.float32), (num_frames // 12 + 1, 1))[:num_frames]
+    beat_times = np.arange(0.0, DURATION, 0.5)
+    return SegmentFeatureIndex(SR, HOP, len(signal), 120.0, beat_times,
+                               _prefix_sum(block_energy), _prefix_sum(centroid),
+                               _prefix_sum(onset), _prefix_sum(chroma))
+
+def test_windows_non_overlapping(index):
+    starts, ends = index.windows(3.0)
+    np.testing.assert_allclose(starts, [0.0, 3.0, 6.0])
+    np.testing.assert_allclose(ends, [3.0, 6.0, 9.0])
+
+def test_windows_overlapping_in_range(index):
+    starts, ends = index.windows(0.5, hop=0.25, start_time=1.0, end_time=2.2)
+    np.testing.assert_allclose(starts, [1.0, 1.25, 1.5])
+    np.testing.assert_allclose(ends, [1.5, 1.75, 2.0])
+
+def test_windows_clamped_to_track(index):
+    starts, _ = index.windows(4.0, start_time=-5.0, end_time=100.0)
+    np.testing.assert_allclose(starts, [0.0, 4.0])
+
+def test_windows_longer_than_track(index):
+    starts, ends = index.windows(20.0)
+    assert len(starts) == 0 and len(ends) == 0
+
+def test_windows_reject_tiny_hop(index):
+    with pytest.raises(ValueError):
+        index.windows(1.0, hop=0.01)
+
+def test_aggregate_energy_matches_signal(index, signal):
+    windows = index.aggregate_windows([0.0, 2.0, 7.5], [DURATION, 5.0, 9.0])
+    expected = [np.mean(np.square(signal[int(s * SR):int(e * SR)], dtype=np.float64))
+                for s, e in [(0.0, DURATION), (2.0, 5.0), (7.5, 9.0)]]
+    np.testing.assert_allclose(windows['energy'], expected, rtol=1e-9)
+
+def test_aggregate_frame_features(index):
+    windows = index.aggregate_windows([2.0], [5.0])
+    # Frames 20 to 49 have their centres inside the window
+    assert windows['spectral_centroid'][0] == pytest.approx(np.mean(np.arange(20, 50)))
+    assert windows['onset_strength'][0] == pytest.approx(1.0)
+    assert windows['chroma'].shape == (1, 12)
+    assert windows['chroma'][0].sum() == pytest.approx(1.0)
+
+def test_aggregate_short_window_uses_one_frame(index):
+    windows = index.aggregate_windows([3.01], [3.02])
+    assert windows['spectral_centroid'][0] == pytest.approx(31.0)
+
+def test_window_tempo_from_beats(index):
+    windows = index.aggregate_windows([1.0, 0.2], [4.0, 0.3])
+    np.testing.assert_allclose(windows['tempo'], [120.0, 120.0])
+
+def test_aggregate_matches_aggregate_windows(index):
+    single = index.aggregate(2.0, 5.0)
+    windows = index.aggregate_windows([2.0], [5.0])
+    for name, values in windows.items():
+        np.testing.assert_allclose(single[name], values[0])
+
+def test_save_load_round_trip(index, tmp_path):
+    path = str(tmp_path / 'track.npz')
+    index.save(path)
+    loaded = SegmentFeatureIndex.load(path)
+    assert loaded.sr == SR and loaded.num_samples == index.num_samples
+    np.testing.assert_array_equal(loaded.chroma_cumsum, index.chroma_cumsum)
+
+def test_evict_keeps_most_recently_used(index, tmp_path):
+    paths = [str(tmp_path / f"{i}.npz") for i in range(4)]
+    for age, path in enumerate(paths):
+        index.save(path)
+        os.utime(path, (1000 + age, 1000 + age))
+
+    # Loading the oldest index marks it as recently used
+    SegmentFeatureIndex.load(paths[0])
+    evict_segment_indexes(2, data_dir=str(tmp_path))
+
+    assert sorted(os.listdir(tmp_path)) == ['0.npz', '3.npz']
+
+@pytest.mark.parametrize('kwargs', [{'segment_duration': np.nan}, {'segment_duration': 1.0, 'hop': np.inf},
+                                    {'segment_duration': 1.0, 'start_time': np.nan},
+                                    {'segment_duration': 1.0, 'end_time': -np.inf}])
+def test_windows_reject_non_finite_times(index, kwargs):
+    with pytest.raises(ValueError):
+        index.windows(**kwargs)
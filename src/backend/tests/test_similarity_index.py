@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from api import similarity_index
+from api.similarity_index import TrackIndex, FEATURE_DIM
+
+@pytest.fixture
+def small_index(monkeypatch):
+    """
+    Switch to the inverted-file index after a few hundred tracks
+    """
+    monkeypatch.setattr(similarity_index, 'EXACT_SEARCH_LIMIT', 400)
+    monkeypatch.setattr(similarity_index, 'INITIAL_CAPACITY', 16)
+
+def unit_vectors(rng, count):
+    vectors = rng.standard_normal((count, FEATURE_DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def clustered_vectors(rng, count, clusters=20):
+    centres = unit_vectors(rng, clusters)
+    vectors = centres[rng.integers(clusters, size=count)] + 0.1 * unit_vectors(rng, count)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def test_add_query_round_trip(small_index, tmp_path):
+    index = TrackIndex(str(tmp_path))
+    vectors = unit_vectors(np.random.default_rng(0), 10)
+    for i, vector in enumerate(vectors):
+        index.add(f"track{i}", vector, name=f"Track {i}")
+
+    best = index.query(vectors[3], k=1)[0]
+    assert best['track_id'] == 'track3' and best['name'] == 'Track 3'
+    assert best['score'] == pytest.approx(1.0, abs=1e-5)
+    assert len(index.query(vectors[3], k=4)) == 4
+    assert index.query(vectors[3], k=0) == []
+    assert all(r['track_id'] != 'track3' for r in index.query_track('track3', k=9))
+    assert index.query_track('unknown') is None
+
+def test_reopen_from_disk_after_growth(small_index, tmp_path):
+    index = TrackIndex(str(tmp_path))
+    vectors = unit_vectors(np.random.default_rng(1), 100)
+    for i, vector in enumerate(vectors):
+        index.add(f"track{i}", vector)
+    # Capacity grows geometrically from INITIAL_CAPACITY
+    assert index._capacity == 128
+
+    reopened = TrackIndex(str(tmp_path))
+    assert len(reopened) == 100
+    for i in (0, 57, 99):
+        assert reopened.query(vectors[i], k=1)[0]['track_id'] == f"track{i}"
+
+def test_update_replaces_vector(small_index, tmp_path):
+    index = TrackIndex(str(tmp_path))
+    first, second = unit_vectors(np.random.default_rng(2), 2)
+    index.add('track', first)
+    index.add('track', second)
+    assert len(index) == 1
+    assert index.query(second, k=1)[0]['score'] == pytest.approx(1.0, abs=1e-5)
+
+def test_update_moves_row_between_lists(small_index, tmp_path):
+    index = TrackIndex(str(tmp_path))
+    rng = np.random.default_rng(3)
+    for i, vector in enumerate(clustered_vectors(rng, 400)):
+        index.add(f"track{i}", vector)
+    assert index._centroids is not None
+
+    row = index._rows['track0']
+    old_list = int(index._assignments[row])
+    new_list = (old_list + 1) % len(index._centroids)
+    index.add('track0', index._centroids[new_list])
+
+    assert int(index._assignments[row]) == new_list
+    assert row in index._lists[new_list] and row not in index._lists[old_list]
+    assert TrackIndex(str(tmp_path))._assignments[row] == new_list
+
+def test_ivf_matches_exact_search(small_index, tmp_path):
+    index = TrackIndex(str(tmp_path))
+    rng = np.random.default_rng(4)
+    vectors = clustered_vectors(rng, 2000)
+    for i, vector in enumerate(vectors):
+        index.add(f"track{i}", vector)
+    assert index._centroids is not None
+
+    recalls = []
+    for query in clustered_vectors(rng, 20):
+        exact = {f"track{i}" for i in np.argsort(-(vectors @ query))[:10]}
+        found = {r['track_id'] for r in index.query(query, k=10)}
+        recalls.append(len(exact & found) / 10)
+    assert np.mean(recalls) >= 0.9
+
+def test_shared_store_between_instances(small_index, tmp_path):
+    # Two instances behave like two worker processes sharing the store
+    first, second = TrackIndex(str(tmp_path)), TrackIndex(str(tmp_path))
+    vectors = unit_vectors(np.random.default_rng(5), 40)
+    for i, vector in enumerate(vectors):
+        (first if i % 2 else second).add(f"track{i}", vector)
+
+    assert first.query(vectors[2], k=1)[0]['track_id'] == 'track2'
+    reopened = TrackIndex(str(tmp_path))
+    assert len(reopened) == 40
+    for i, vector in enumerate(vectors):
+        assert reopened.query(vector, k=1)[0]['track_id'] == f"track{i}"